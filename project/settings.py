@@ -31,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+  'raidikalu.middleware.RequestLatencyMiddleware',
+  'raidikalu.middleware.QueryBudgetMiddleware',
   'django.middleware.security.SecurityMiddleware',
   'corsheaders.middleware.CorsMiddleware',
   'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -1,18 +1,60 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
 from django.utils.html import format_html
-from raidikalu.models import InfoBox, Gym, GymNickname, RaidType, Raid, DataSource, RaidVote, Attendance
+from raidikalu.bestiary import get_monster_name_suggestion
+from raidikalu.gym_index import record_gym_changes
+from raidikalu.models import InfoBox, Gym, GymNickname, RaidType, RaidTypeRegistry, Raid, DataSource, RaidVote, Attendance, RaidHistory, PendingRaidData, FailedRaidData
+from raidikalu.utils import bump_data_version
+
+
+def queryset_updated(queryset):
+  # Bulk updates skip the save signals the caches rely on
+  if queryset.model is Gym:
+    record_gym_changes(list(queryset.values_list('pk', flat=True)))
+  elif queryset.model is RaidType:
+    RaidTypeRegistry.invalidate()
+    bump_data_version()
 
 
 def make_active(modeladmin, request, queryset):
   queryset.update(is_active=True)
+  queryset_updated(queryset)
 make_active.short_description = 'Mark selected as active'
 
 
 def make_inactive(modeladmin, request, queryset):
   queryset.update(is_active=False)
+  queryset_updated(queryset)
 make_inactive.short_description = 'Mark selected as not active'
 
 
+def delete_attendances(modeladmin, request, queryset):
+  # Bulk deletes skip Attendance.delete, which keeps the attendees of the raid up to date
+  raid_ids = list(queryset.values_list('raid_id', flat=True).distinct())
+  queryset.delete()
+  Raid.rebuild_attendees(raid_ids)
+delete_attendances.short_description = 'Delete selected attendances'
+
+
+def delete_votes(modeladmin, request, queryset):
+  # Bulk deletes skip RaidVote.delete, which keeps the vote tallies of the raid up to date
+  keys = list(queryset.values_list('raid_id', 'vote_field').distinct())
+  with transaction.atomic():
+    queryset.delete()
+    RaidVote.votes_changed(keys)
+delete_votes.short_description = 'Delete selected votes'
+
+
+def requeue_raid_data(modeladmin, request, queryset):
+  with transaction.atomic():
+    PendingRaidData.objects.bulk_create([
+      PendingRaidData(data_source_id=item.data_source_id, raid_data=item.raid_data, received_at=item.received_at)
+      for item in queryset
+    ])
+    queryset.delete()
+requeue_raid_data.short_description = 'Move selected back to the ingestion queue'
+
+
 def make_ex_eligible(modeladmin, request, queryset):
   queryset.update(is_ex_eligible=True)
 make_ex_eligible.short_description = 'Mark selected as EX eligible'
@@ -40,16 +82,84 @@ class RaidTypeAdmin(admin.ModelAdmin):
     super().__init__(*args, **kwargs)
     RaidType.get_tier_display.short_description = 'Tier'
 
+  def save_model(self, request, obj, form, change):
+    super(RaidTypeAdmin, self).save_model(request, obj, form, change)
+    suggestion = get_monster_name_suggestion(obj.monster_name)
+    if suggestion:
+      self.message_user(request, 'Unknown raid boss "%s", did you mean "%s"?' % (obj.monster_name, suggestion), messages.WARNING)
+
   def image_tag(self, obj):
     return format_html('<img src="%s" width="32" height="32" style="margin: -8px 0;" />' % obj.get_image_url()) if obj.get_image_url() else ''
   image_tag.short_description = 'Image'
 
 
+class GymNicknameAdmin(admin.ModelAdmin):
+  list_select_related = ('gym',)
+  raw_id_fields = ('gym',)
+
+
+class RaidAdmin(admin.ModelAdmin):
+  list_display = ('__str__', 'tier', 'start_at', 'end_at')
+  list_select_related = ('gym',)
+  raw_id_fields = ('gym',)
+
+
+class RaidVoteAdmin(admin.ModelAdmin):
+  list_select_related = ('raid__gym',)
+  raw_id_fields = ('raid',)
+  actions = [delete_votes]
+
+  def get_actions(self, request):
+    actions = super(RaidVoteAdmin, self).get_actions(request)
+    actions.pop('delete_selected', None)
+    return actions
+
+
+class AttendanceAdmin(admin.ModelAdmin):
+  list_select_related = ('raid__gym',)
+  raw_id_fields = ('raid',)
+  actions = [delete_attendances]
+
+  def get_actions(self, request):
+    actions = super(AttendanceAdmin, self).get_actions(request)
+    actions.pop('delete_selected', None)
+    return actions
+
+  def get_readonly_fields(self, request, obj=None):
+    # Moving an attendance would leave the submitter among the attendees of the old raid
+    return ('raid', 'submitter') if obj else ()
+
+
+class RaidHistoryAdmin(admin.ModelAdmin):
+  list_display = ('gym', 'tier', 'monster_number', 'start_at', 'attendance_count', 'data_source')
+  list_filter = ('tier', 'data_source')
+  list_select_related = ('gym', 'data_source')
+  date_hierarchy = 'start_at'
+  raw_id_fields = ('gym',)
+  readonly_fields = ('gym', 'data_source', 'tier', 'monster_number', 'start_at', 'end_at', 'attendance_count')
+
+  def has_add_permission(self, request):
+    return False
+
+
+class FailedRaidDataAdmin(admin.ModelAdmin):
+  list_display = ('data_source', 'received_at', 'failed_at', 'attempt_count')
+  list_filter = ('data_source',)
+  list_select_related = ('data_source',)
+  readonly_fields = ('data_source', 'raid_data', 'received_at', 'failed_at', 'attempt_count', 'error')
+  actions = [requeue_raid_data]
+
+  def has_add_permission(self, request):
+    return False
+
+
 admin.site.register(InfoBox)
 admin.site.register(Gym, GymAdmin)
-admin.site.register(GymNickname)
+admin.site.register(GymNickname, GymNicknameAdmin)
 admin.site.register(RaidType, RaidTypeAdmin)
-admin.site.register(Raid)
+admin.site.register(Raid, RaidAdmin)
 admin.site.register(DataSource)
-admin.site.register(RaidVote)
-admin.site.register(Attendance)
+admin.site.register(RaidVote, RaidVoteAdmin)
+admin.site.register(Attendance, AttendanceAdmin)
+admin.site.register(RaidHistory, RaidHistoryAdmin)
+admin.site.register(FailedRaidData, FailedRaidDataAdmin)
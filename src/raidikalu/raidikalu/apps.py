@@ -1,6 +1,5 @@
-
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 
 
 class RaidikaluConfig(AppConfig):
@@ -8,6 +7,27 @@ class RaidikaluConfig(AppConfig):
   verbose_name = 'Raidikalu'
 
   def ready(self):
+    from raidikalu.authentication import data_source_changed
+    from raidikalu.gym_index import gym_changed
     from raidikalu.messages import raid_updated
+    from raidikalu.models import RaidTypeRegistry
+    from raidikalu.utils import bump_data_version
     post_save.connect(raid_updated, sender='raidikalu.Raid')
-
+    post_save.connect(bump_data_version, sender='raidikalu.Raid')
+    post_save.connect(bump_data_version, sender='raidikalu.RaidVote')
+    post_save.connect(bump_data_version, sender='raidikalu.Attendance')
+    post_delete.connect(bump_data_version, sender='raidikalu.Raid')
+    post_delete.connect(bump_data_version, sender='raidikalu.Attendance')
+    post_save.connect(bump_data_version, sender='raidikalu.InfoBox')
+    post_save.connect(bump_data_version, sender='raidikalu.RaidType')
+    post_delete.connect(bump_data_version, sender='raidikalu.InfoBox')
+    post_delete.connect(bump_data_version, sender='raidikalu.RaidType')
+    post_save.connect(RaidTypeRegistry.invalidate, sender='raidikalu.RaidType')
+    post_delete.connect(RaidTypeRegistry.invalidate, sender='raidikalu.RaidType')
+    pre_save.connect(data_source_changed, sender='raidikalu.DataSource')
+    post_save.connect(data_source_changed, sender='raidikalu.DataSource')
+    post_delete.connect(data_source_changed, sender='raidikalu.DataSource')
+    post_save.connect(gym_changed, sender='raidikalu.Gym')
+    post_save.connect(gym_changed, sender='raidikalu.GymNickname')
+    post_delete.connect(gym_changed, sender='raidikalu.Gym')
+    post_delete.connect(gym_changed, sender='raidikalu.GymNickname')
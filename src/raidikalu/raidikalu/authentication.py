@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+from django.core.cache import cache
+from raidikalu import settings
+from raidikalu.models import DataSource
+from raidikalu.stats import STATS_CACHE_KEY_PREFIX, increment_stat
+
+
+DATA_SOURCE_CACHE_KEY = 'raidikalu_data_source_%s'
+DATA_SOURCE_REQUESTS_STAT_NAME = 'data_source_requests_%s'
+UNKNOWN_DATA_SOURCE = 0
+
+
+class DataSourceCache(object):
+  # Remembers which data source each API key belongs to, and which keys are unknown,
+  # first in process memory for a short while and then in the shared cache
+  def __init__(self, local_timeout):
+    self.local_timeout = local_timeout
+    self.lock = threading.Lock()
+    self.data_sources = {}
+
+  def get_local(self, key_hash):
+    with self.lock:
+      data_source, expires_at = self.data_sources.get(key_hash, (None, 0))
+    return data_source if expires_at > time.time() else None
+
+  def set_local(self, key_hash, data_source):
+    with self.lock:
+      self.data_sources[key_hash] = (data_source, time.time() + self.local_timeout)
+
+  def forget(self, api_key):
+    key_hash = get_api_key_hash(api_key)
+    cache.delete(DATA_SOURCE_CACHE_KEY % key_hash)
+    with self.lock:
+      self.data_sources.pop(key_hash, None)
+
+  def get_data_source(self, api_key):
+    key_hash = get_api_key_hash(api_key)
+    data_source = self.get_local(key_hash)
+    if data_source is None:
+      data_source = cache.get(DATA_SOURCE_CACHE_KEY % key_hash)
+      if data_source is None:
+        increment_stat('auth_cache_misses')
+        data_source = DataSource.objects.filter(api_key=api_key).first() or UNKNOWN_DATA_SOURCE
+        timeout = settings.DATA_SOURCE_CACHE_TIMEOUT if data_source else settings.DATA_SOURCE_NEGATIVE_CACHE_TIMEOUT
+        cache.set(DATA_SOURCE_CACHE_KEY % key_hash, data_source, timeout)
+      self.set_local(key_hash, data_source)
+    return data_source or None
+
+
+data_source_cache = DataSourceCache(settings.DATA_SOURCE_LOCAL_CACHE_TIMEOUT)
+
+
+def get_api_key_hash(api_key):
+  return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def authenticate_data_source(api_key):
+  # Returns the data source with the API key, or None if there is no such data source
+  data_source = None
+  if api_key and len(api_key) <= DataSource._meta.get_field('api_key').max_length:
+    data_source = data_source_cache.get_data_source(api_key)
+  if data_source:
+    increment_stat(DATA_SOURCE_REQUESTS_STAT_NAME % data_source.pk)
+  else:
+    increment_stat('auth_rejected_requests')
+  return data_source
+
+
+def data_source_changed(sender, instance, **kwargs):
+  # Connected to both pre_save and post_save, so that a replaced key stops working
+  # and a new key is not left behind as unknown. Other processes notice within
+  # the local cache timeout.
+  data_source_cache.forget(instance.api_key)
+  if instance.pk:
+    for api_key in DataSource.objects.filter(pk=instance.pk).values_list('api_key', flat=True):
+      data_source_cache.forget(api_key)
+
+
+def get_data_source_stats():
+  data_sources = list(DataSource.objects.order_by('pk'))
+  cache_keys = [STATS_CACHE_KEY_PREFIX + DATA_SOURCE_REQUESTS_STAT_NAME % data_source.pk for data_source in data_sources]
+  values = cache.get_many(cache_keys)
+  return {
+    data_source.name: {'requests': values.get(cache_key, 0)}
+    for data_source, cache_key in zip(data_sources, cache_keys)
+  }
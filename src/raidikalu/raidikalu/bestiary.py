@@ -1,3 +1,9 @@
+import difflib
+import re
+import unicodedata
+from functools import lru_cache
+from raidikalu import settings
+
 
 monster_species = [
   (1, 'Bulbasaur'),
@@ -805,6 +811,74 @@ monster_species = [
 ]
 
 
+# Other spellings seen in feeds and user input, in addition to the ones normalization already covers
+monster_aliases = [
+  (29, 'Nidoran F'),
+  (29, 'Nidoran Female'),
+  (32, 'Nidoran M'),
+  (32, 'Nidoran Male'),
+  (772, 'Type Null'),
+]
+
+
+FUZZY_MATCH_CUTOFF = 0.8
+NON_ALPHANUMERIC_REGEX = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_monster_name(name):
+  # Folds case, diacritics, apostrophes and punctuation, so that "Farfetch'd",
+  # "FARFETCHD" and "Farfetch’d" or "flabebe" and "Flabébé" are the same name
+  name = str(name).replace('\u2640', ' f').replace('\u2642', ' m')
+  name = unicodedata.normalize('NFKD', name.lower())
+  name = ''.join(character for character in name if not unicodedata.combining(character))
+  return NON_ALPHANUMERIC_REGEX.sub('', name)
+
+
+def build_monster_index():
+  index = {}
+  extra_aliases = [(number, name) for name, number in settings.MONSTER_ALIASES.items()]
+  for number, name in monster_species + monster_aliases + extra_aliases:
+    index.setdefault(normalize_monster_name(name), number)
+  return index
+
+
+MONSTER_NUMBERS_BY_NORMALIZED_NAME = build_monster_index()
+MONSTER_NAMES_BY_NUMBER = {number: name for number, name in monster_species}
+NORMALIZED_MONSTER_NAMES = sorted(MONSTER_NUMBERS_BY_NORMALIZED_NAME.keys())
+
+
 def get_monster_number_by_name(name):
-  monster_numbers_by_names = {name: number for number, name in monster_species}
-  return monster_numbers_by_names.get(name, None)
+  if not name:
+    return None
+  return MONSTER_NUMBERS_BY_NORMALIZED_NAME.get(normalize_monster_name(name), None)
+
+
+def get_monster_name_by_number(number):
+  try:
+    return MONSTER_NAMES_BY_NUMBER.get(int(number), None)
+  except (TypeError, ValueError):
+    return None
+
+
+@lru_cache(maxsize=1024)
+def get_closest_monster_number(name):
+  # Falls back to the most similar known name, for typos like "Mewto". A near miss may
+  # well be another monster, so this is only for suggestions and never used when saving.
+  monster_number = get_monster_number_by_name(name)
+  if monster_number or not name:
+    return monster_number
+  closest_names = difflib.get_close_matches(normalize_monster_name(name), NORMALIZED_MONSTER_NAMES, n=1, cutoff=FUZZY_MATCH_CUTOFF)
+  if not closest_names:
+    return None
+  return MONSTER_NUMBERS_BY_NORMALIZED_NAME[closest_names[0]]
+
+
+def get_canonical_monster_name(name):
+  return get_monster_name_by_number(get_monster_number_by_name(name)) or name
+
+
+def get_monster_name_suggestion(name):
+  # Returns the known name that an unknown name is probably a typo of
+  if not name or get_monster_number_by_name(name):
+    return None
+  return get_monster_name_by_number(get_closest_monster_number(name))
@@ -1,11 +1,41 @@
-
 from channels import Group
+from django.core.cache import cache
+from raidikalu.ingestion import drain_ingestion_queue
+from raidikalu.messages import get_missed_events, get_snapshot_event_text
+from raidikalu.subscriptions import GROUP_NAME, get_resume_sequence, get_subscription_group_names
+
+
+SUBSCRIPTION_CACHE_KEY = 'raidikalu_subscription_%s'
+SUBSCRIPTION_CACHE_TIMEOUT = 24 * 60 * 60
 
 
 def ws_connect(message):
   message.reply_channel.send({'accept': True})
-  Group('raidikalu').add(message.reply_channel)
+  query_string = message.content.get('query_string', '')
+  group_names = get_subscription_group_names(query_string)
+  # Channel sessions do not work with signed cookie sessions, so the groups are remembered in the cache
+  cache.set(SUBSCRIPTION_CACHE_KEY % message.reply_channel.name, group_names, SUBSCRIPTION_CACHE_TIMEOUT)
+  for group_name in group_names:
+    Group(group_name).add(message.reply_channel)
+
+  # Clients resuming from a known event get only what they missed, or a snapshot
+  # event telling them to reload if those events are no longer available
+  since = get_resume_sequence(query_string)
+  if since is not None:
+    missed_event_texts = get_missed_events(since, group_names)
+    if missed_event_texts is None:
+      message.reply_channel.send({'text': get_snapshot_event_text()})
+    else:
+      for event_text in missed_event_texts:
+        message.reply_channel.send({'text': event_text})
 
 
 def ws_disconnect(message):
-  Group('raidikalu').discard(message.reply_channel)
+  cache_key = SUBSCRIPTION_CACHE_KEY % message.reply_channel.name
+  for group_name in cache.get(cache_key) or [GROUP_NAME]:
+    Group(group_name).discard(message.reply_channel)
+  cache.delete(cache_key)
+
+
+def ingest_queued_raids(message):
+  drain_ingestion_queue()
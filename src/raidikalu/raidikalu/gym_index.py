@@ -0,0 +1,100 @@
+import threading
+from abc import ABC, abstractmethod
+from django.core.cache import cache
+from raidikalu.models import Gym
+
+
+GYM_INDEX_VERSION_CACHE_KEY = 'raidikalu_gym_index_version'
+GYM_INDEX_CHANGE_CACHE_KEY = 'raidikalu_gym_index_change_%s'
+GYM_INDEX_CHANGE_LOG_SIZE = 1000
+GYM_INDEX_CHANGE_LOG_TIMEOUT = 24 * 60 * 60
+
+
+def get_gym_index_version():
+  return cache.get(GYM_INDEX_VERSION_CACHE_KEY) or 0
+
+
+def record_gym_changes(gym_ids):
+  # Every change is numbered and logged, so that each process can update its own
+  # indexes with only the gyms that changed since they were last synced
+  for gym_id in gym_ids:
+    try:
+      version = cache.incr(GYM_INDEX_VERSION_CACHE_KEY)
+    except ValueError:
+      cache.add(GYM_INDEX_VERSION_CACHE_KEY, 0, None)
+      version = cache.incr(GYM_INDEX_VERSION_CACHE_KEY)
+    cache.set(GYM_INDEX_CHANGE_CACHE_KEY % (version % GYM_INDEX_CHANGE_LOG_SIZE), {
+      'version': version,
+      'gym': gym_id,
+    }, GYM_INDEX_CHANGE_LOG_TIMEOUT)
+
+
+def gym_changed(sender, instance, **kwargs):
+  record_gym_changes([instance.pk if isinstance(instance, Gym) else instance.gym_id])
+
+
+class GymIndex(ABC):
+  # An in-process index of gyms that follows the gym change log
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.version = None
+    self.clear()
+
+  @abstractmethod
+  def clear(self):
+    pass
+
+  @abstractmethod
+  def add_gym(self, gym):
+    pass
+
+  @abstractmethod
+  def remove_gym(self, gym_id):
+    pass
+
+  def get_queryset(self):
+    return Gym.objects.all()
+
+  def load_gyms(self, gym_ids=None):
+    gyms = self.get_queryset()
+    if gym_ids is not None:
+      gyms = gyms.filter(pk__in=gym_ids)
+    loaded_gym_ids = set()
+    for gym in gyms:
+      self.add_gym(gym)
+      loaded_gym_ids.add(gym.pk)
+    for gym_id in set(gym_ids or []) - loaded_gym_ids:
+      self.remove_gym(gym_id)
+
+  def rebuild(self):
+    self.clear()
+    self.load_gyms()
+
+  def get_changed_gym_ids(self, version):
+    # Returns the gyms changed after the synced version, or None if the change log
+    # no longer covers them all and the whole index has to be rebuilt
+    if self.version is None or version < self.version or version - self.version > GYM_INDEX_CHANGE_LOG_SIZE:
+      return None
+    versions = range(self.version + 1, version + 1)
+    cache_keys = [GYM_INDEX_CHANGE_CACHE_KEY % (change_version % GYM_INDEX_CHANGE_LOG_SIZE) for change_version in versions]
+    changes = cache.get_many(cache_keys)
+    gym_ids = set()
+    for change_version, cache_key in zip(versions, cache_keys):
+      change = changes.get(cache_key, None)
+      if not change or change['version'] != change_version:
+        return None
+      gym_ids.add(change['gym'])
+    return gym_ids
+
+  def sync(self):
+    # Must be called with the lock held. Returns True if the index was rebuilt.
+    version = get_gym_index_version()
+    if version == self.version:
+      return False
+    changed_gym_ids = self.get_changed_gym_ids(version)
+    if changed_gym_ids is None:
+      self.rebuild()
+    else:
+      self.load_gyms(changed_gym_ids)
+    self.version = version
+    return changed_gym_ids is None
@@ -0,0 +1,91 @@
+import math
+from raidikalu import settings
+from raidikalu.gym_index import GymIndex
+from raidikalu.spatial import EARTH_RADIUS_METERS, get_distance
+from raidikalu.stats import increment_stat
+
+
+class GymResolver(GymIndex):
+  # Resolves raid payloads to gyms by their pogo_id, or by their coordinates when
+  # the id is missing or unknown. Coordinates are bucketed into a grid of cells
+  # as tall as the match radius, so only a few cells have to be looked at.
+  def __init__(self, match_radius):
+    self.match_radius = match_radius
+    self.cell_size = math.degrees(match_radius / EARTH_RADIUS_METERS)
+    super(GymResolver, self).__init__()
+
+  def clear(self):
+    self.gyms = {}
+    self.gyms_by_pogo_id = {}
+    self.gym_ids_by_cell = {}
+
+  def get_cell(self, latitude, longitude):
+    return int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size))
+
+  def add_gym(self, gym):
+    self.remove_gym(gym.pk)
+    gym_latitude, gym_longitude = float(gym.latitude), float(gym.longitude)
+    self.gyms[gym.pk] = (gym, gym_latitude, gym_longitude)
+    if gym.pogo_id:
+      self.gyms_by_pogo_id[gym.pogo_id] = gym
+    self.gym_ids_by_cell.setdefault(self.get_cell(gym_latitude, gym_longitude), set()).add(gym.pk)
+
+  def remove_gym(self, gym_id):
+    gym_entry = self.gyms.pop(gym_id, None)
+    if not gym_entry:
+      return
+    gym, gym_latitude, gym_longitude = gym_entry
+    if self.gyms_by_pogo_id.get(gym.pogo_id, None) is gym:
+      del self.gyms_by_pogo_id[gym.pogo_id]
+    cell = self.get_cell(gym_latitude, gym_longitude)
+    self.gym_ids_by_cell[cell].discard(gym_id)
+    if not self.gym_ids_by_cell[cell]:
+      del self.gym_ids_by_cell[cell]
+
+  def get_nearest_gym(self, latitude, longitude):
+    # A degree of longitude gets shorter towards the poles, so more columns are needed
+    longitude_radius = self.cell_size / max(math.cos(math.radians(latitude)), 0.01)
+    first_row, first_column = self.get_cell(latitude - self.cell_size, longitude - longitude_radius)
+    last_row, last_column = self.get_cell(latitude + self.cell_size, longitude + longitude_radius)
+    nearest_gym = None
+    nearest_distance = self.match_radius
+    for row in range(first_row, last_row + 1):
+      for column in range(first_column, last_column + 1):
+        for gym_id in self.gym_ids_by_cell.get((row, column), ()):
+          gym, gym_latitude, gym_longitude = self.gyms[gym_id]
+          distance = get_distance(latitude, longitude, gym_latitude, gym_longitude)
+          if distance <= nearest_distance:
+            nearest_gym = gym
+            nearest_distance = distance
+    return nearest_gym
+
+  def resolve(self, locations):
+    # Takes a list of (pogo_id, latitude, longitude) tuples, any of which may be None,
+    # and returns the matching gyms or None for each
+    counts = {'gym_resolver_id_matches': 0, 'gym_resolver_location_matches': 0, 'gym_resolver_misses': 0}
+    gyms = []
+    with self.lock:
+      if self.sync():
+        increment_stat('gym_resolver_rebuilds')
+      for pogo_id, latitude, longitude in locations:
+        gym = self.gyms_by_pogo_id.get(pogo_id, None) if pogo_id else None
+        if gym:
+          counts['gym_resolver_id_matches'] += 1
+        elif latitude is not None and longitude is not None:
+          gym = self.get_nearest_gym(latitude, longitude)
+        if gym is None:
+          counts['gym_resolver_misses'] += 1
+        elif not gym.pogo_id or gym.pogo_id != pogo_id:
+          counts['gym_resolver_location_matches'] += 1
+        gyms.append(gym)
+    for stat_name, count in counts.items():
+      if count:
+        increment_stat(stat_name, count)
+    return gyms
+
+
+gym_resolver = GymResolver(settings.GYM_MATCH_RADIUS)
+
+
+def resolve_gyms(locations):
+  return gym_resolver.resolve(locations)
@@ -0,0 +1,126 @@
+import bisect
+import difflib
+import re
+import unicodedata
+from raidikalu import settings
+from raidikalu.gym_index import GymIndex
+from raidikalu.models import Gym
+
+
+NON_ALPHANUMERIC_REGEX = re.compile(r'[^a-z0-9]+')
+
+SCORE_EXACT = 3
+SCORE_PREFIX = 2
+SCORE_INFIX = 1
+SCORE_FUZZY = 1
+INFIX_MIN_LENGTH = 3
+FUZZY_MIN_LENGTH = 4
+FUZZY_CUTOFF = 0.8
+
+
+def fold_text(text):
+  # Lowercases and strips accents, so that "paakirjasto" finds "Pääkirjasto"
+  text = unicodedata.normalize('NFKD', text.lower())
+  text = ''.join(character for character in text if not unicodedata.combining(character))
+  return NON_ALPHANUMERIC_REGEX.sub(' ', text).strip()
+
+
+class GymSearchIndex(GymIndex):
+  def clear(self):
+    self.gyms = {}
+    self.token_gym_ids = {}
+    self.sorted_tokens = []
+
+  def get_queryset(self):
+    return Gym.objects.prefetch_related('nicknames')
+
+  def add_gym(self, gym):
+    self.remove_gym(gym.pk)
+    if not gym.is_active:
+      return
+    names = [fold_text(gym.name)] + [fold_text(nickname.nickname) for nickname in gym.nicknames.all()]
+    tokens = set(token for name in names for token in name.split())
+    self.gyms[gym.pk] = {
+      'id': gym.pk,
+      'name': gym.name,
+      'image_url': gym.image_url,
+      'names': names,
+      'tokens': tokens,
+    }
+    for token in tokens:
+      if token not in self.token_gym_ids:
+        self.token_gym_ids[token] = set()
+        bisect.insort(self.sorted_tokens, token)
+      self.token_gym_ids[token].add(gym.pk)
+
+  def remove_gym(self, gym_id):
+    gym = self.gyms.pop(gym_id, None)
+    if not gym:
+      return
+    for token in gym['tokens']:
+      gym_ids = self.token_gym_ids[token]
+      gym_ids.discard(gym_id)
+      if not gym_ids:
+        del self.token_gym_ids[token]
+        del self.sorted_tokens[bisect.bisect_left(self.sorted_tokens, token)]
+
+  def get_token_scores(self, query_token):
+    scores = {}
+    start_index = bisect.bisect_left(self.sorted_tokens, query_token)
+    for token in self.sorted_tokens[start_index:]:
+      if not token.startswith(query_token):
+        break
+      score = SCORE_EXACT if token == query_token else SCORE_PREFIX
+      for gym_id in self.token_gym_ids[token]:
+        scores[gym_id] = max(scores.get(gym_id, 0), score)
+    if len(query_token) >= INFIX_MIN_LENGTH:
+      # Finnish names are often compounds, so "kirjasto" should find "Pääkirjasto"
+      for token in self.sorted_tokens:
+        if query_token in token:
+          for gym_id in self.token_gym_ids[token]:
+            scores.setdefault(gym_id, SCORE_INFIX)
+    if len(query_token) >= FUZZY_MIN_LENGTH:
+      # Typos are only looked for among the tokens starting with the same letter
+      first_index = bisect.bisect_left(self.sorted_tokens, query_token[0])
+      last_index = bisect.bisect_left(self.sorted_tokens, chr(ord(query_token[0]) + 1))
+      candidates = self.sorted_tokens[first_index:last_index]
+      for token in difflib.get_close_matches(query_token, candidates, n=10, cutoff=FUZZY_CUTOFF):
+        for gym_id in self.token_gym_ids[token]:
+          scores.setdefault(gym_id, SCORE_FUZZY)
+    return scores
+
+  def search(self, query, limit):
+    query = fold_text(query)
+    query_tokens = query.split()
+    if not query_tokens:
+      return []
+    with self.lock:
+      self.sync()
+      scores = None
+      for query_token in query_tokens:
+        token_scores = self.get_token_scores(query_token)
+        if scores is None:
+          scores = token_scores
+        else:
+          scores = {gym_id: score + token_scores[gym_id] for gym_id, score in scores.items() if gym_id in token_scores}
+        if not scores:
+          return []
+      results = []
+      for gym_id, score in scores.items():
+        gym = self.gyms[gym_id]
+        if any(name.startswith(query) for name in gym['names']):
+          score += SCORE_EXACT
+        results.append((-score, gym['name'], gym))
+    results.sort(key=lambda result: result[:2])
+    return [{
+      'id': gym['id'],
+      'name': gym['name'],
+      'image_url': gym['image_url'],
+    } for score, name, gym in results[:limit]]
+
+
+gym_search_index = GymSearchIndex()
+
+
+def search_gyms(query, limit=None):
+  return gym_search_index.search(query, limit or settings.GYM_SEARCH_RESULT_LIMIT)
@@ -0,0 +1,420 @@
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime
+from itertools import groupby
+from channels import Channel
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
+from raidikalu import settings
+from raidikalu.bestiary import get_monster_name_by_number, get_monster_number_by_name
+from raidikalu.gym_resolver import resolve_gyms
+from raidikalu.models import DataSource, FailedRaidData, PendingRaidData, Raid, RaidVote, RaidVoteTally, raid_type_registry
+from raidikalu.spatial import InvalidLocation, parse_coordinates
+from raidikalu.stats import increment_stat, set_stat
+
+
+LOG = logging.getLogger(__name__)
+
+INGESTION_CHANNEL = 'raidikalu.ingest'
+FINGERPRINT_CACHE_KEY = 'raidikalu_raid_fingerprint_%s'
+
+
+THRESHOLD_OF_LOOKING_A_LOT_LIKE_MILLISECONDS = 1000000000000
+
+RESULT_OK = 'ok'
+RESULT_EXPIRED = 'expired'
+RESULT_UNKNOWN_GYM = 'unknown_gym'
+RESULT_INVALID = 'invalid'
+RESULT_QUEUED = 'queued'
+RESULT_DUPLICATE = 'duplicate'
+
+
+class InvalidRaidData(ValueError):
+  pass
+
+
+def parse_raid_data_list(body):
+  if isinstance(body, bytes):
+    body = body.decode('utf-8')
+  body = body.strip()
+  if body.startswith('['):
+    raid_data_list = json.loads(body)
+    if not isinstance(raid_data_list, list):
+      raise InvalidRaidData('Expected a list of raids')
+    return raid_data_list
+  # Anything else is treated as newline delimited JSON, one raid per line
+  raid_data_list = []
+  for line in body.splitlines():
+    if not line.strip():
+      continue
+    try:
+      raid_data_list.append(json.loads(line))
+    except ValueError:
+      raid_data_list.append(None)
+  return raid_data_list
+
+
+def get_text_field(raid_data, field_name):
+  # Returns the text of the field, or None if it is missing or empty
+  value = raid_data.get(field_name, None)
+  if value is None or value == '':
+    return None
+  if not isinstance(value, str):
+    raise InvalidRaidData('Invalid %s' % field_name)
+  return value
+
+
+def parse_raid_data(raid_data):
+  if not isinstance(raid_data, dict):
+    raise InvalidRaidData('Not an object')
+
+  latitude = None
+  longitude = None
+  if raid_data.get('latitude', None) is not None and raid_data.get('longitude', None) is not None:
+    try:
+      latitude, longitude = parse_coordinates(raid_data.get('latitude'), raid_data.get('longitude'))
+    except InvalidLocation:
+      raise InvalidRaidData('Invalid coordinates')
+
+  gym_id = raid_data.get('gym_id', None)
+  if isinstance(gym_id, int) and not isinstance(gym_id, bool):
+    gym_id = str(gym_id)
+  elif gym_id is not None and not isinstance(gym_id, str):
+    raise InvalidRaidData('Invalid gym_id')
+
+  if not gym_id and latitude is None:
+    raise InvalidRaidData('Missing gym_id and coordinates')
+
+  votes = []
+  start_at = None
+
+  if raid_data.get('tier', None):
+    tier = raid_data.get('tier')
+    if isinstance(tier, bool) or not isinstance(tier, (int, str)) or not str(tier).isdigit():
+      raise InvalidRaidData('Invalid tier')
+    votes.append({
+      'vote_field': RaidVote.FIELD_TIER,
+      'vote_value': tier,
+    })
+
+  monster = get_text_field(raid_data, 'monster')
+  if monster:
+    votes.append({
+      'vote_field': RaidVote.FIELD_MONSTER,
+      'vote_value': monster,
+    })
+
+  fast_move = get_text_field(raid_data, 'fast_move')
+  if fast_move:
+    fast_move = re.sub(r'([A-Z])', r' \1', fast_move)
+    votes.append({
+      'vote_field': RaidVote.FIELD_FAST_MOVE,
+      'vote_value': fast_move,
+    })
+
+  charge_move = get_text_field(raid_data, 'charge_move')
+  if charge_move:
+    charge_move = re.sub(r'([A-Z])', r' \1', charge_move)
+    votes.append({
+      'vote_field': RaidVote.FIELD_CHARGE_MOVE,
+      'vote_value': charge_move,
+    })
+
+  if raid_data.get('start_time', None):
+    try:
+      start_timestamp = int(raid_data.get('start_time'))
+    except (TypeError, ValueError, OverflowError):
+      raise InvalidRaidData('Invalid start_time')
+    is_milliseconds = start_timestamp > THRESHOLD_OF_LOOKING_A_LOT_LIKE_MILLISECONDS
+    if is_milliseconds:
+      start_timestamp = start_timestamp / 1000.0
+    try:
+      start_at = datetime.fromtimestamp(start_timestamp)
+    except (OverflowError, OSError, ValueError):
+      raise InvalidRaidData('Invalid start_time')
+    votes.append({
+      'vote_field': RaidVote.FIELD_START_AT,
+      'vote_value': str(int(start_timestamp)),
+    })
+    start_at = timezone.make_aware(start_at, timezone.get_current_timezone())
+
+  return {
+    'gym_id': gym_id or None,
+    'latitude': latitude,
+    'longitude': longitude,
+    'votes': votes,
+    'start_at': start_at,
+  }
+
+
+def canonicalize_monster_votes(parsed_items):
+  # Monster names are stored the way their raid type spells them, so that votes for
+  # "Farfetchd" and "Farfetch’d" are counted together and match the raid type. Only exact
+  # names and aliases are looked up, as the closest name of an unknown one may be another monster.
+  monster_votes = [
+    vote for parsed_item in parsed_items
+    for vote in parsed_item['votes'] if vote['vote_field'] == RaidVote.FIELD_MONSTER
+  ]
+  for vote in monster_votes:
+    monster_number = get_monster_number_by_name(vote['vote_value'])
+    raid_type = raid_type_registry.get_by_number(monster_number) if monster_number else None
+    vote['vote_value'] = raid_type.monster_name if raid_type else get_monster_name_by_number(monster_number) or vote['vote_value']
+
+
+def get_fingerprint_cache_key(data_source, parsed_item):
+  # The data source is a part of the fingerprint, so that the same report from another
+  # source still records its votes. Those only cause a save when they change the raid.
+  fingerprint_data = [data_source.pk, parsed_item['gym_id'], parsed_item['latitude'], parsed_item['longitude']]
+  fingerprint_data += sorted([vote['vote_field'], str(vote['vote_value'])] for vote in parsed_item['votes'])
+  return FINGERPRINT_CACHE_KEY % hashlib.sha1(json.dumps(fingerprint_data).encode('utf-8')).hexdigest()
+
+
+def drop_duplicates(data_source, parsed_items, results):
+  # Drops the items that were already ingested a moment ago, or earlier in the same list,
+  # and returns the fingerprint cache keys of the rest
+  fingerprint_cache_keys = {index: get_fingerprint_cache_key(data_source, parsed_item) for index, parsed_item in parsed_items.items()}
+  seen_cache_keys = set(cache.get_many(list(fingerprint_cache_keys.values())).keys())
+  duplicate_count = 0
+  for index in sorted(fingerprint_cache_keys.keys()):
+    cache_key = fingerprint_cache_keys[index]
+    if cache_key in seen_cache_keys:
+      results[index] = {'status': RESULT_DUPLICATE}
+      del parsed_items[index]
+      del fingerprint_cache_keys[index]
+      duplicate_count += 1
+    seen_cache_keys.add(cache_key)
+  if duplicate_count:
+    increment_stat('ingestion_duplicates', duplicate_count)
+  return fingerprint_cache_keys
+
+
+def ingest_raids(data_source, raid_data_list):
+  now = timezone.now()
+  results = [None] * len(raid_data_list)
+  parsed_items = {}
+
+  for index, raid_data in enumerate(raid_data_list):
+    try:
+      parsed_item = parse_raid_data(raid_data)
+    except InvalidRaidData:
+      results[index] = {'status': RESULT_INVALID}
+      continue
+    start_at = parsed_item['start_at']
+    if start_at and start_at + Raid.RAID_BATTLE_DURATION <= now:
+      results[index] = {'status': RESULT_EXPIRED}
+      continue
+    parsed_items[index] = parsed_item
+
+  canonicalize_monster_votes(parsed_items.values())
+  fingerprint_cache_keys = drop_duplicates(data_source, parsed_items, results)
+  if not parsed_items:
+    return results
+  parsed_indexes = list(parsed_items.keys())
+  gyms = resolve_gyms([
+    (parsed_items[index]['gym_id'], parsed_items[index]['latitude'], parsed_items[index]['longitude'])
+    for index in parsed_indexes
+  ])
+  gyms_by_index = dict(zip(parsed_indexes, gyms))
+  gym_ids = set(gym.pk for gym in gyms if gym)
+
+  with transaction.atomic():
+    raids_by_gym_id = {}
+    if gym_ids:
+      existing_raids = Raid.objects.exclude(end_at__lte=now).filter(gym_id__in=gym_ids, is_active=True).select_related('gym')
+      raids_by_gym_id = {raid.gym_id: raid for raid in existing_raids}
+
+    existing_vote_keys = set()
+    if raids_by_gym_id:
+      existing_vote_keys = set(
+        RaidVote.objects
+        .filter(raid__in=raids_by_gym_id.values(), data_source=data_source)
+        .values_list('raid_id', 'vote_field')
+      )
+
+    touched_raids = {}
+    created_raid_ids = set()
+    new_votes = []
+
+    # The gyms without a current raid get one, created with the first report of the gym,
+    # so that counting the votes finds the raid up to date
+    new_raids_by_gym_id = {}
+    for index, parsed_item in parsed_items.items():
+      gym = gyms_by_index[index]
+      if gym and gym.pk not in raids_by_gym_id and gym.pk not in new_raids_by_gym_id:
+        new_raid = Raid(gym=gym, data_source=data_source)
+        new_raid.set_vote_values({vote['vote_field']: vote['vote_value'] for vote in parsed_item['votes']})
+        # The tallies the votes are about to make, so that the raid is verified from the start
+        new_raid._vote_tallies = {
+          vote['vote_field']: [RaidVoteTally(vote_field=vote['vote_field'], vote_value=str(vote['vote_value']), vote_count=1, data_source_vote_at=now)]
+          for vote in parsed_item['votes']
+        }
+        new_raids_by_gym_id[gym.pk] = new_raid
+    if new_raids_by_gym_id:
+      for raid, created in Raid.create_active_raids(list(new_raids_by_gym_id.values())):
+        raids_by_gym_id[raid.gym_id] = raid
+        if created:
+          created_raid_ids.add(raid.pk)
+        else:
+          # Another worker created the raid a moment ago
+          existing_vote_keys.update(
+            RaidVote.objects.filter(raid=raid, data_source=data_source).values_list('raid_id', 'vote_field')
+          )
+
+    for index, parsed_item in parsed_items.items():
+      gym = gyms_by_index[index]
+      if not gym:
+        results[index] = {'status': RESULT_UNKNOWN_GYM}
+        continue
+
+      raid = raids_by_gym_id[gym.pk]
+      for vote in parsed_item['votes']:
+        vote_key = (raid.pk, vote['vote_field'])
+        if vote_key in existing_vote_keys:
+          continue
+        existing_vote_keys.add(vote_key)
+        new_votes.append(RaidVote(raid=raid, data_source=data_source, created_at=now, updated_at=now, **vote))
+
+      touched_raids[raid.pk] = raid
+      results[index] = {'status': RESULT_OK, 'raid': raid.pk, 'created': raid.pk in created_raid_ids}
+
+    RaidVote.objects.bulk_create(new_votes)
+    RaidVoteTally.record_votes(new_votes)
+
+    # The tallies of every raid are counted, so they are fetched at once
+    prefetch_related_objects(list(touched_raids.values()), 'vote_tallies')
+    for raid in touched_raids.values():
+      raid.count_votes_and_update()
+
+  # Remembered only once the raids are stored, as a caller may still roll them back
+  seen_fingerprints = {
+    fingerprint_cache_keys[index]: True
+    for index, result in enumerate(results) if result['status'] == RESULT_OK
+  }
+  transaction.on_commit(lambda: cache.set_many(seen_fingerprints, settings.INGESTION_FINGERPRINT_TIMEOUT))
+  return results
+
+
+def enqueue_raids(data_source, raid_data_list):
+  # Stores the valid raid data for the workers and returns the status of each item
+  results = [None] * len(raid_data_list)
+  parsed_items = {}
+  for index, raid_data in enumerate(raid_data_list):
+    try:
+      parsed_items[index] = parse_raid_data(raid_data)
+    except InvalidRaidData:
+      results[index] = {'status': RESULT_INVALID}
+  canonicalize_monster_votes(parsed_items.values())
+  drop_duplicates(data_source, parsed_items, results)
+  pending_raid_data = []
+  for index in sorted(parsed_items.keys()):
+    pending_raid_data.append(PendingRaidData(data_source=data_source, raid_data=json.dumps(raid_data_list[index])))
+    results[index] = {'status': RESULT_QUEUED}
+  if pending_raid_data:
+    PendingRaidData.objects.bulk_create(pending_raid_data)
+    increment_stat('ingestion_queue_received', len(pending_raid_data))
+    channel = Channel(INGESTION_CHANNEL)
+    try:
+      channel.send({'queued': len(pending_raid_data)})
+    except channel.channel_layer.ChannelFull:
+      # The queue is kept in the database, so the workers already woken up will get to it
+      LOG.warning('Ingestion channel is full')
+  return results
+
+
+def ingest_pending_raid_data(data_source, pending_raid_data):
+  # Ingests the items in a savepoint and returns the items that failed with their errors.
+  # When a group fails, its items are retried one by one to find the ones to blame.
+  try:
+    with transaction.atomic():
+      ingest_raids(data_source, [json.loads(item.raid_data) for item in pending_raid_data])
+    return []
+  except Exception as e:
+    if len(pending_raid_data) == 1:
+      LOG.exception('Could not ingest queued raid data', extra={'data': {'pending_raid_data': pending_raid_data[0].pk}})
+      return [(pending_raid_data[0], repr(e))]
+  failed_items = []
+  for item in pending_raid_data:
+    failed_items += ingest_pending_raid_data(data_source, [item])
+  return failed_items
+
+
+def record_failed_raid_data(failed_items):
+  # Failed items stay in the queue for another attempt, until they run out of attempts
+  # and are moved to the dead letter table
+  failed_raid_data = []
+  retried_ids = []
+  for item, error in failed_items:
+    if item.attempt_count + 1 >= settings.INGESTION_QUEUE_MAX_ATTEMPTS:
+      failed_raid_data.append(FailedRaidData(
+        data_source_id=item.data_source_id,
+        raid_data=item.raid_data,
+        received_at=item.received_at,
+        attempt_count=item.attempt_count + 1,
+        error=error,
+      ))
+    else:
+      retried_ids.append(item.pk)
+  if failed_raid_data:
+    FailedRaidData.objects.bulk_create(failed_raid_data)
+    increment_stat('ingestion_queue_failed', len(failed_raid_data))
+  if retried_ids:
+    PendingRaidData.objects.filter(pk__in=retried_ids).update(attempt_count=F('attempt_count') + 1)
+    increment_stat('ingestion_queue_retried', len(retried_ids))
+  return retried_ids
+
+
+def drain_ingestion_queue(batch_size=None):
+  # Ingests the queued raid data in batches until the queue is empty. Rows are locked
+  # while they are processed, so several workers can drain the queue at the same time.
+  batch_size = batch_size or settings.INGESTION_QUEUE_BATCH_SIZE
+  processed_count = 0
+  retried_ids = set()
+  while True:
+    with transaction.atomic():
+      # The items that failed during this drain are left for the next one
+      pending_raid_data = list(
+        PendingRaidData.objects
+        .select_for_update(skip_locked=True)
+        .exclude(pk__in=retried_ids)
+        .order_by('pk')[:batch_size]
+      )
+      if not pending_raid_data:
+        break
+      data_sources = DataSource.objects.in_bulk(set(item.data_source_id for item in pending_raid_data))
+      # Items of the same raid are ingested together, so each raid is updated once per batch
+      items = sorted(
+        ((item.data_source_id, get_queued_gym_id(item), item) for item in pending_raid_data),
+        key=lambda item: item[:2],
+      )
+      failed_items = []
+      for data_source_id, data_source_items in groupby(items, key=lambda item: item[0]):
+        failed_items += ingest_pending_raid_data(data_sources[data_source_id], [item for _, _, item in data_source_items])
+      retried_ids.update(record_failed_raid_data(failed_items))
+      PendingRaidData.objects.filter(pk__in=[item.pk for item in pending_raid_data]).exclude(pk__in=retried_ids).delete()
+    lag = (timezone.now() - pending_raid_data[0].received_at).total_seconds()
+    processed_count += len(pending_raid_data)
+    increment_stat('ingestion_queue_batches')
+    increment_stat('ingestion_queue_processed', len(pending_raid_data))
+    set_stat('ingestion_queue_last_lag', round(lag, 3))
+  return processed_count
+
+
+def get_queued_gym_id(item):
+  try:
+    raid_data = json.loads(item.raid_data)
+  except ValueError:
+    return ''
+  return str(raid_data.get('gym_id', None) or '') if isinstance(raid_data, dict) else ''
+
+
+def get_ingestion_queue_stats():
+  oldest_received_at = PendingRaidData.objects.order_by('pk').values_list('received_at', flat=True).first()
+  return {
+    'depth': PendingRaidData.objects.count(),
+    'failed': FailedRaidData.objects.count(),
+    'lag': round((timezone.now() - oldest_received_at).total_seconds(), 3) if oldest_received_at else 0,
+  }
@@ -0,0 +1,130 @@
+import json
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import resolve, reverse
+from django.utils import timezone
+from raidikalu.models import Attendance, DataSource, Gym, Raid, RaidType, RaidVote
+from raidikalu.query_budget import QueryRecorder, get_query_budget, get_query_problems
+from raidikalu.utils import DATA_VERSION_CACHE_KEY, bump_cache_version
+
+
+class Command(BaseCommand):
+  help = (
+    'Requests the main pages and APIs with sample data in a scratch test database and fails '
+    'if any goes over its query budget or repeats a query'
+  )
+
+  RAID_COUNT = 5
+
+  def add_arguments(self, parser):
+    parser.add_argument('--raids', type=int, default=self.RAID_COUNT, help='Number of sample raids, enough to make per-raid queries repeat')
+
+  def handle(self, *args, **options):
+    # The requests commit for real, so that the work done once a transaction commits is
+    # counted too. They run against a test database, which is thrown away afterwards.
+    setup_test_environment()
+    old_database_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+      problems = self.check_requests(options['raids'], options['verbosity'])
+    finally:
+      connection.creation.destroy_test_db(old_database_name, verbosity=0)
+      teardown_test_environment()
+    if problems:
+      raise CommandError('Query budgets exceeded:\n\n%s' % '\n\n'.join(problems))
+    self.stdout.write('All requests are within their query budgets')
+
+  def create_sample_data(self, raid_count):
+    now = timezone.now()
+    data_source = DataSource.objects.create(name='Query budget check', api_key=uuid.uuid4().hex)
+    raid_type = RaidType.objects.create(tier=5, monster_name='Mewtwo')
+    raids = []
+    for index in range(raid_count):
+      gym = Gym.objects.create(
+        name='Query budget gym %s' % index,
+        pogo_id='query-budget-%s-%s' % (uuid.uuid4().hex, index),
+        latitude=60.0 + index * 0.01,
+        longitude=25.0,
+      )
+      raid, created = Raid.get_or_create_active(gym, defaults={'raid_type': raid_type, 'start_at': now + timedelta(minutes=index)})
+      RaidVote.objects.create(raid=raid, submitter='Ash', vote_field=RaidVote.FIELD_MONSTER, vote_value=raid_type.monster_name)
+      for submitter in ('Ash', 'Misty'):
+        Attendance.objects.create(raid=raid, submitter=submitter, start_time_choice=0)
+      raids.append(raid)
+    new_gyms = [
+      Gym.objects.create(
+        name='Query budget new gym %s' % index,
+        pogo_id='query-budget-new-%s-%s' % (uuid.uuid4().hex, index),
+        latitude=61.0 + index * 0.01,
+        longitude=25.0,
+      )
+      for index in range(raid_count + 2)
+    ]
+    return data_source, raids, new_gyms
+
+  def get_requests(self, data_source, raids, new_gyms):
+    # Each request is (method, path, data, content type)
+    api_key = data_source.api_key
+    start_time = int(time.time()) + 60
+    raid_data_list = [
+      {'gym_id': raid.gym.pogo_id, 'tier': 5, 'monster': 'Mewtwo', 'start_time': start_time}
+      for raid in raids
+    ]
+    # The gyms with no raids yet, where the batch has to create them
+    new_raid_data_list = [
+      {'gym_id': gym.pogo_id, 'tier': 5, 'monster': 'Mewtwo', 'start_time': start_time}
+      for gym in new_gyms[2:]
+    ]
+    return [
+      ('get', reverse('raidikalu.raid_list'), None, None),
+      ('post', reverse('raidikalu.raid_list'), {'action': 'set-attendance', 'raid': raids[0].pk, 'choice': '1'}, None),
+      ('get', reverse('raidikalu.raid_list_json'), None, None),
+      ('get', reverse('raidikalu.raid_snippet', kwargs={'pk': raids[0].pk}), None, None),
+      ('get', reverse('raidikalu.raid_create'), None, None),
+      ('post', reverse('raidikalu.raid_create'), {
+        'gym': new_gyms[0].pk,
+        'raid-boss': 'Mewtwo',
+        'raid-time-field-type': 'start',
+        'raid-time-value-type': 'relative',
+        'raid-time': '5',
+      }, None),
+      ('post', reverse('raidikalu.raid_receiver', kwargs={'api_key': api_key}), json.dumps(raid_data_list[0]), 'application/json'),
+      ('post', reverse('raidikalu.raid_batch_receiver', kwargs={'api_key': api_key}), json.dumps(raid_data_list), 'application/json'),
+      ('post', reverse('raidikalu.raid_receiver', kwargs={'api_key': api_key}), json.dumps(dict(new_raid_data_list[0], gym_id=new_gyms[1].pogo_id)), 'application/json'),
+      ('post', reverse('raidikalu.raid_batch_receiver', kwargs={'api_key': api_key}), '\n'.join(json.dumps(raid_data) for raid_data in new_raid_data_list), 'application/x-ndjson'),
+      ('post', reverse('raidikalu.gym_receiver', kwargs={'api_key': api_key}), json.dumps({
+        'guid': 'query-budget-gym-%s' % uuid.uuid4().hex,
+        'name': 'Query budget received gym',
+        'latitude': 62.0,
+        'longitude': 25.0,
+        'image_url': '',
+      }), 'application/json'),
+      ('get', reverse('raidikalu.raid_export', kwargs={'api_key': api_key}), None, None),
+      ('get', reverse('raidikalu.raid_export', kwargs={'api_key': api_key}), {'format': 'ndjson'}, None),
+      ('get', reverse('raidikalu.raid_export', kwargs={'api_key': api_key}), {'since': 0}, None),
+    ]
+
+  def check_requests(self, raid_count, verbosity):
+    data_source, raids, new_gyms = self.create_sample_data(raid_count)
+    client = Client()
+    problems = []
+    for method, path, data, content_type in self.get_requests(data_source, raids, new_gyms):
+      url_name = resolve(path).url_name
+      kwargs = {'content_type': content_type} if content_type else {}
+      # Cached pages are dropped so that the queries behind them are counted
+      bump_cache_version(DATA_VERSION_CACHE_KEY)
+      with QueryRecorder() as recorder:
+        response = getattr(client, method)(path, data, **kwargs)
+        if response.streaming:
+          b''.join(response.streaming_content)
+      if response.status_code >= 400:
+        problems.append('%s %s returned %s' % (method.upper(), path, response.status_code))
+      problems.extend(get_query_problems(url_name, recorder))
+      if verbosity >= 2:
+        self.stdout.write('%s %s: %s queries, budget %s' % (method.upper(), path, len(recorder.queries), get_query_budget(url_name)))
+    return problems
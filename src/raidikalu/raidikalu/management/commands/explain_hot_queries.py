@@ -0,0 +1,69 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from raidikalu.models import Attendance, DataSource, Gym, Raid, RaidVote, RaidVoteTally
+
+
+def get_hot_queries():
+  # The queries run on every page load or data source request, with the table each should find its rows in by index
+  now = timezone.now()
+  return [
+    ('raid list', Raid._meta.db_table, Raid.objects.exclude(end_at__lte=now).order_by('start_at')),
+    ('reaper', Raid._meta.db_table, Raid.objects.filter(end_at__lt=now).values_list('pk', flat=True)[:500]),
+    ('change feed', Raid._meta.db_table, Raid.objects.filter(change_seq__gt=0).order_by('change_seq')[:100]),
+    ('active raids of gyms', Raid._meta.db_table, Raid.objects.filter(gym_id__in=[1, 2], is_active=True)),
+    ('earlier votes of submitter', RaidVote._meta.db_table, RaidVote.objects.filter(raid_id__in=[1, 2], vote_field__in=[RaidVote.FIELD_TIER], submitter__in=['']).values_list('raid_id', 'vote_field', 'submitter')),
+    ('votes of data source', RaidVote._meta.db_table, RaidVote.objects.filter(raid__in=[1, 2], data_source_id=1).values_list('raid_id', 'vote_field')),
+    ('raids reported by data source', RaidVote._meta.db_table, RaidVote.objects.filter(data_source_id=1, vote_field=RaidVote.FIELD_MONSTER).values_list('raid_id', flat=True)),
+    ('vote tallies', RaidVoteTally._meta.db_table, RaidVoteTally.objects.filter(raid_id__in=[1, 2])),
+    ('attendance of submitter', Attendance._meta.db_table, Attendance.objects.filter(raid_id=1, submitter='')),
+    ('gym by pogo_id', Gym._meta.db_table, Gym.objects.filter(pogo_id='')),
+    ('data source by api key', DataSource._meta.db_table, DataSource.objects.filter(api_key='')),
+  ]
+
+
+def get_query_plan(queryset):
+  sql, params = queryset.query.sql_with_params()
+  with connection.cursor() as cursor:
+    if connection.vendor == 'sqlite':
+      cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+      return [row[-1] for row in cursor.fetchall()]
+    cursor.execute('EXPLAIN ' + sql, params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def is_table_scanned(plan, table):
+  # SQLite reports "SCAN [TABLE] <table>" without an index, PostgreSQL "Seq Scan on <table>"
+  if connection.vendor == 'sqlite':
+    regex = re.compile(r'\bSCAN (TABLE )?%s\b(?!.*\bUSING\b)' % re.escape(table))
+  else:
+    regex = re.compile(r'\bSeq Scan on %s\b' % re.escape(table))
+  return any(regex.search(line) for line in plan)
+
+
+class Command(BaseCommand):
+  help = 'Explains the hot queries and fails if any of them scans its whole table instead of using an index'
+
+  def handle(self, *args, **options):
+    if connection.vendor not in ('sqlite', 'postgresql'):
+      raise CommandError('Query plans can only be checked on SQLite and PostgreSQL')
+    failed_queries = []
+    with transaction.atomic():
+      if connection.vendor == 'postgresql':
+        # The tables may be too small for the planner to bother with indexes, so
+        # sequential scans are discouraged to see whether an index could be used
+        with connection.cursor() as cursor:
+          cursor.execute('SET LOCAL enable_seqscan = off')
+      for name, table, queryset in get_hot_queries():
+        plan = get_query_plan(queryset)
+        is_scanned = is_table_scanned(plan, table)
+        if is_scanned:
+          failed_queries.append(name)
+        if is_scanned or options['verbosity'] >= 2:
+          self.stdout.write('%s: %s' % (name, 'FULL SCAN' if is_scanned else 'OK'))
+          for line in plan:
+            self.stdout.write('  %s' % line)
+    if failed_queries:
+      raise CommandError('Queries not using an index: %s' % ', '.join(failed_queries))
+    self.stdout.write('All %s hot queries use an index' % len(get_hot_queries()))
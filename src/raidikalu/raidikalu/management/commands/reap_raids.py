@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from raidikalu import settings
+from raidikalu.ingestion import drain_ingestion_queue
+from raidikalu.reaper import reap_expired_raids
+
+
+class Command(BaseCommand):
+  help = 'Archives and deletes expired raids in bounded batches and drains the ingestion queue, optionally repeating on an interval'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--loop', action='store_true', help='Keep running and reap on every interval')
+    parser.add_argument('--interval', type=float, default=settings.REAPER_INTERVAL, help='Seconds between runs when looping')
+    parser.add_argument('--batch-size', type=int, default=settings.REAPER_BATCH_SIZE, help='Maximum number of raids deleted per statement')
+
+  def handle(self, *args, **options):
+    while True:
+      close_old_connections()
+      result = reap_expired_raids(batch_size=options['batch_size'])
+      if options['verbosity'] >= 2 or result['deleted_raids']:
+        self.stdout.write('Archived %(archived_raids)s and deleted %(deleted_raids)s raids (%(deleted_rows)s rows) in %(duration).3fs' % result)
+      if settings.INGESTION_QUEUE_ENABLED:
+        # Picks up the raid data the workers were not woken up for, or left for another attempt
+        processed_count = drain_ingestion_queue()
+        if options['verbosity'] >= 2 or processed_count:
+          self.stdout.write('Ingested %s queued raids' % processed_count)
+      if not options['loop']:
+        break
+      time.sleep(options['interval'])
@@ -1,24 +1,251 @@
 
+import atexit
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
 from channels import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 from django.utils.dateformat import format as format_datetime
+from raidikalu import settings
+from raidikalu.stats import increment_stat
+from raidikalu.subscriptions import GROUP_NAME, get_raid_group_names
+from raidikalu.utils import bump_cache_version, get_cache_version
 
 
-def send_event(event_name, event_message, event_data=None):
-  Group('raidikalu').send({
-    'text': json.dumps({
-      'event': event_name,
-      'message': event_message,
-      'data': event_data,
-    }),
+LOG = logging.getLogger(__name__)
+
+EVENT_SEQUENCE_CACHE_KEY = 'raidikalu_event_sequence'
+EVENT_LOG_CACHE_KEY = 'raidikalu_event_log_%s'
+
+
+def get_event_sequence():
+  # Seeded from the current time, so the sequence keeps growing past what the clients
+  # have seen even if the cache is cleared
+  return get_cache_version(EVENT_SEQUENCE_CACHE_KEY)
+
+
+def get_next_event_sequence():
+  return bump_cache_version(EVENT_SEQUENCE_CACHE_KEY)
+
+
+def get_missed_events(since, group_names):
+  # Returns the texts of the events after the given sequence number that were sent
+  # to any of the given groups, or None if they are no longer all in the event log
+  current_sequence = get_event_sequence()
+  if since > current_sequence or current_sequence - since > settings.EVENT_LOG_SIZE:
+    return None
+  sequences = range(since + 1, current_sequence + 1)
+  cache_keys = [EVENT_LOG_CACHE_KEY % (sequence % settings.EVENT_LOG_SIZE) for sequence in sequences]
+  logged_events = cache.get_many(cache_keys)
+  group_names = set(group_names)
+  event_texts = []
+  for sequence, cache_key in zip(sequences, cache_keys):
+    logged_event = logged_events.get(cache_key, None)
+    if not logged_event or logged_event['seq'] != sequence:
+      return None
+    if group_names.intersection(logged_event['groups']):
+      event_texts.append(logged_event['text'])
+  return event_texts
+
+
+def get_snapshot_event_text():
+  return json.dumps({
+    'event': 'snapshot',
+    'message': 'Tapahtumia on jäänyt välistä',
+    'data': None,
+    'seq': get_event_sequence(),
   })
 
 
+class GroupRateLimiter(object):
+  # Limits the events of each subscription group. The groups in exempt_group_names are
+  # not limited, as the global group receives every event and limiting it would cap
+  # all broadcasts at its rate.
+  def __init__(self, rate, burst, exempt_group_names=(GROUP_NAME,)):
+    self.rate = rate
+    self.burst = burst
+    self.exempt_group_names = set(exempt_group_names)
+    self.lock = threading.Lock()
+    self.buckets = {}
+
+  def allow(self, group_names):
+    if not self.rate:
+      return True
+    group_names = [group_name for group_name in group_names if group_name not in self.exempt_group_names]
+    with self.lock:
+      now = time.time()
+      buckets = []
+      for group_name in group_names:
+        tokens, updated_at = self.buckets.get(group_name, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+          return False
+        buckets.append((group_name, tokens))
+      for group_name, tokens in buckets:
+        self.buckets[group_name] = (tokens - 1, now)
+    return True
+
+
+class EventCoalescer(object):
+  # Collects events for a short window and publishes only the latest event per key,
+  # so a raid saved several times in a row is broadcast once. Only one flush runs at
+  # a time, and the pending events are flushed without rate limits on exit.
+  def __init__(self, window, rate_limiter):
+    self.window = window
+    self.rate_limiter = rate_limiter
+    self.lock = threading.Lock()
+    self.flush_lock = threading.Lock()
+    self.pending_events = OrderedDict()
+    self.timer = None
+    self.counts = {'events_received': 0, 'events_coalesced': 0, 'events_deferred': 0, 'events_published': 0}
+
+  def add(self, key, event):
+    if not self.window:
+      with self.lock:
+        self.counts['events_received'] += 1
+      self.publish([event])
+      return
+    with self.lock:
+      self.counts['events_received'] += 1
+      if key in self.pending_events:
+        self.counts['events_coalesced'] += 1
+        del self.pending_events[key]
+      self.pending_events[key or object()] = event
+      self.start_timer()
+
+  def start_timer(self):
+    # Called with the lock held
+    if not self.timer:
+      self.timer = threading.Timer(self.window, self.flush)
+      self.timer.daemon = True
+      self.timer.start()
+
+  def flush(self, force=False):
+    with self.flush_lock:
+      with self.lock:
+        pending_events = self.pending_events
+        self.pending_events = OrderedDict()
+        if self.timer:
+          self.timer.cancel()
+          self.timer = None
+      events = []
+      deferred_events = OrderedDict()
+      for key, event in pending_events.items():
+        if force or self.rate_limiter.allow(event['groups']):
+          events.append(event)
+        else:
+          deferred_events[key] = event
+      if deferred_events:
+        with self.lock:
+          self.counts['events_deferred'] += len(deferred_events)
+          for key, event in deferred_events.items():
+            # Newer events for the same key replace the deferred ones
+            self.pending_events.setdefault(key, event)
+          self.start_timer()
+      try:
+        self.publish(events)
+      except Exception:
+        LOG.exception('Could not publish events')
+
+  def close(self):
+    self.flush(force=True)
+
+  def publish(self, events):
+    for event in events:
+      publish_event(event)
+    with self.lock:
+      self.counts['events_published'] += len(events)
+    self.save_counts()
+
+  def save_counts(self):
+    with self.lock:
+      counts = self.counts
+      self.counts = {stat_name: 0 for stat_name in counts}
+    for stat_name, count in counts.items():
+      if count:
+        increment_stat(stat_name, count)
+
+
+event_coalescer = EventCoalescer(
+  settings.EVENT_COALESCE_WINDOW,
+  GroupRateLimiter(settings.EVENT_GROUP_RATE_LIMIT, settings.EVENT_GROUP_RATE_BURST),
+)
+atexit.register(event_coalescer.close)
+
+
+def send_event(event_name, event_message, event_data=None, raid=None, key=None):
+  # Events with the same key are coalesced, by default those of the same raid. They are
+  # queued only once the transaction commits, so rolled back changes are never broadcast.
+  event = {
+    'event': event_name,
+    'message': event_message,
+    'data': event_data,
+    'groups': get_raid_group_names(raid) if raid else [GROUP_NAME],
+  }
+  if key is None and raid:
+    key = (event_name, raid.pk)
+  transaction.on_commit(lambda: event_coalescer.add(key, event))
+
+
+def publish_event(event):
+  group_names = event['groups']
+  event_sequence = get_next_event_sequence()
+  event_text = json.dumps({
+    'event': event['event'],
+    'message': event['message'],
+    'data': event['data'],
+    'seq': event_sequence,
+  })
+  # The event log is a ring buffer of the latest events, used to catch up reconnecting clients
+  cache.set(EVENT_LOG_CACHE_KEY % (event_sequence % settings.EVENT_LOG_SIZE), {
+    'seq': event_sequence,
+    'groups': group_names,
+    'text': event_text,
+  }, settings.EVENT_LOG_TIMEOUT)
+  for group_name in group_names:
+    Group(group_name).send({
+      'text': event_text,
+    })
+
+
+def get_attendance_data(raid):
+  start_times = []
+  for start_time in raid.get_start_times_with_attendances():
+    start_times.append({
+      'time': format_datetime(timezone.localtime(start_time['time']), 'H:i'),
+      'attendees': start_time['attendees'],
+    })
+  return {
+    'count': raid.attendance_count,
+    'start_times': start_times,
+  }
+
+
+def get_raid_data(raid):
+  return {
+    'raid': raid.pk,
+    'gym': raid.gym.name,
+    'monster': raid.monster_name,
+    'tier': raid.tier,
+    'fast_move': raid.fast_move,
+    'charge_move': raid.charge_move,
+    'lat': str(raid.gym.latitude),
+    'lng': str(raid.gym.longitude),
+    'start': int(raid.start_at.timestamp()) if raid.start_at else None,
+    'end': int(raid.end_at.timestamp()) if raid.end_at else None,
+    'attendance': get_attendance_data(raid),
+  }
+
+
 def attendance_updated(attendance, raid=None):
   raid = raid or attendance.raid
   if attendance.start_time_choice is not None:
     start_time = raid.get_start_time_choices()[attendance.start_time_choice]
-    start_time_str = format_datetime(start_time, 'H:i')
+    start_time_str = format_datetime(timezone.localtime(start_time), 'H:i')
     message = '%s tulee raidille %s' % (attendance.submitter, start_time_str)
   else:
     start_time_str = None
@@ -31,7 +258,11 @@ def attendance_updated(attendance, raid=None):
       'choice': attendance.start_time_choice,
       'time': start_time_str,
       'submitter': attendance.submitter,
+      'attendance': get_attendance_data(raid),
     },
+    raid,
+    # Each submitter has their own key, so that one attendance does not replace another
+    key=('attendance', raid.pk, attendance.submitter),
   )
 
 
@@ -41,19 +272,7 @@ def raid_updated(instance, created, **kwargs):
     message = 'Raidi %s lisätty' % instance.pk
   else:
     message = 'Raidi %s päivitetty' % instance.pk
-  send_event(
-    'raid',
-    message,
-    {
-      'raid': raid.pk,
-      'gym': raid.gym.name,
-      'pokemon': raid.monster_name, # Backwards compatibility
-      'monster': raid.monster_name,
-      'tier': raid.tier,
-      'lat': str(raid.gym.latitude),
-      'lng': str(raid.gym.longitude),
-      'start': int(raid.start_at.timestamp()) if raid.start_at else None,
-      'end': int(raid.end_at.timestamp()) if raid.end_at else None,
-      'created': created,
-    },
-  )
+  raid_data = get_raid_data(raid)
+  raid_data['pokemon'] = raid.monster_name # Backwards compatibility
+  raid_data['created'] = created
+  send_event('raid', message, raid_data, raid)
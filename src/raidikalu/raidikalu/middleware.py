@@ -0,0 +1,42 @@
+import logging
+import time
+from django.core.exceptions import MiddlewareNotUsed
+from raidikalu import settings
+from raidikalu.query_budget import QueryRecorder, get_query_problems
+from raidikalu.throttling import page_latency_monitor
+
+
+LOG = logging.getLogger(__name__)
+
+
+class RequestLatencyMiddleware(object):
+  # Measures how long user-facing pages take, for shedding ingestion load when they slow down
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    started_at = time.time()
+    response = self.get_response(request)
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match and resolver_match.url_name in settings.LATENCY_TRACKED_URL_NAMES:
+      page_latency_monitor.record(time.time() - started_at)
+    return response
+
+
+class QueryBudgetMiddleware(object):
+  # Development aid that logs the requests going over their query budget or repeating
+  # a query. Queries run while a streaming response is consumed are not counted.
+  def __init__(self, get_response):
+    if not settings.QUERY_BUDGET_MIDDLEWARE_ENABLED:
+      raise MiddlewareNotUsed()
+    self.get_response = get_response
+
+  def __call__(self, request):
+    with QueryRecorder() as recorder:
+      response = self.get_response(request)
+    response['X-Query-Count'] = str(len(recorder.queries))
+    resolver_match = getattr(request, 'resolver_match', None)
+    url_name = resolver_match.url_name if resolver_match else request.path
+    for problem in get_query_problems(url_name, recorder):
+      LOG.warning(problem)
+    return response
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def tally_existing_votes(apps, schema_editor):
+    RaidVote = apps.get_model('raidikalu', 'RaidVote')
+    RaidVoteTally = apps.get_model('raidikalu', 'RaidVoteTally')
+
+    tallies = {}
+    counted_submitters = set()
+    for vote in RaidVote.objects.order_by('id'):
+        key = (vote.raid_id, vote.vote_field, vote.vote_value)
+        tally = tallies.get(key)
+        if not tally:
+            tally = RaidVoteTally(raid_id=vote.raid_id, vote_field=vote.vote_field, vote_value=vote.vote_value)
+            tallies[key] = tally
+        tally.vote_count += 1
+        tally.last_vote_at = vote.created_at
+        if vote.data_source_id:
+            tally.data_source_vote_at = vote.created_at
+        elif (vote.raid_id, vote.vote_field, vote.submitter) not in counted_submitters:
+            counted_submitters.add((vote.raid_id, vote.vote_field, vote.submitter))
+            tally.submitter_count += 1
+    RaidVoteTally.objects.bulk_create(tallies.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0015_add_raid_type_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RaidVoteTally',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vote_field', models.CharField(choices=[('tier', 'Tier'), ('monster_name', 'Raid boss'), ('fast_move', 'Fast move'), ('charge_move', 'Charge move'), ('start_at', 'Starting time')], max_length=255)),
+                ('vote_value', models.CharField(max_length=255)),
+                ('vote_count', models.PositiveIntegerField(default=0)),
+                ('submitter_count', models.PositiveIntegerField(default=0)),
+                ('last_vote_at', models.DateTimeField(blank=True, null=True)),
+                ('data_source_vote_at', models.DateTimeField(blank=True, null=True)),
+                ('raid', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_tallies', to='raidikalu.Raid')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='raidvotetally',
+            unique_together=set([('raid', 'vote_field', 'vote_value')]),
+        ),
+        migrations.RunPython(tally_existing_votes, migrations.RunPython.noop),
+    ]
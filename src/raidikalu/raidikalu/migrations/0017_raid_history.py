@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0016_raid_vote_tally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RaidHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tier', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('monster_number', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('start_at', models.DateTimeField()),
+                ('end_at', models.DateTimeField()),
+                ('attendance_count', models.PositiveIntegerField(default=0)),
+                ('data_source', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='raidikalu.DataSource')),
+                ('gym', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='raid_history', to='raidikalu.Gym')),
+            ],
+            options={
+                'verbose_name_plural': 'raid history',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='raidhistory',
+            index=models.Index(fields=['gym', 'start_at'], name='raidikalu_r_gym_id_a6f685_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='raidhistory',
+            index=models.Index(fields=['start_at'], name='raidikalu_r_start_a_4d8f96_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# A copy of raidikalu.utils.encode_geohash as it was when this migration was written,
+# so that later changes to it do not change what the migration does
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(latitude, longitude, precision=12):
+    coordinates = [float(longitude), float(latitude)]
+    ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+    geohash = []
+    bits = 0
+    for bit_index in range(precision * 5):
+        axis = bit_index % 2
+        middle = (ranges[axis][0] + ranges[axis][1]) / 2
+        bits <<= 1
+        if coordinates[axis] >= middle:
+            bits |= 1
+            ranges[axis][0] = middle
+        else:
+            ranges[axis][1] = middle
+        if bit_index % 5 == 4:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+    return ''.join(geohash)
+
+
+def set_gym_geohashes(apps, schema_editor):
+    Gym = apps.get_model('raidikalu', 'Gym')
+
+    for gym in Gym.objects.all():
+        gym.geohash = encode_geohash(gym.latitude, gym.longitude)
+        gym.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0017_raid_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gym',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(set_gym_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0018_gym_geohash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='datasource',
+            name='api_key',
+            field=models.CharField(db_index=True, max_length=2048),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0019_data_source_api_key_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRaidData',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raid_data', models.TextField()),
+                ('received_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('data_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_raid_data', to='raidikalu.DataSource')),
+            ],
+        ),
+    ]
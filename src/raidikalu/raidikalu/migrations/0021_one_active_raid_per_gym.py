@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_active_raids(apps, schema_editor):
+    Raid = apps.get_model('raidikalu', 'Raid')
+
+    # The newest raid of each gym that has not ended is its active raid
+    active_raid_ids = {}
+    now = timezone.now()
+    for raid in Raid.objects.exclude(end_at__lte=now).order_by('created_at', 'id'):
+        active_raid_ids[raid.gym_id] = raid.id
+    Raid.objects.filter(id__in=active_raid_ids.values()).update(is_active=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0020_pending_raid_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='raid',
+            name='is_active',
+            field=models.NullBooleanField(default=None, editable=False),
+        ),
+        migrations.RunPython(mark_active_raids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='raid',
+            name='is_active',
+            field=models.NullBooleanField(default=True, editable=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name='raid',
+            unique_together=set([('gym', 'is_active')]),
+        ),
+    ]
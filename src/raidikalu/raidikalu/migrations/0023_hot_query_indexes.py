@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def remove_duplicate_attendances(apps, schema_editor):
+    Attendance = apps.get_model('raidikalu', 'Attendance')
+
+    # The latest attendance of each submitter to a raid is the one that is kept
+    attendance_ids = {}
+    duplicate_ids = []
+    for attendance_id, raid_id, submitter in Attendance.objects.order_by('updated_at', 'id').values_list('id', 'raid_id', 'submitter'):
+        key = (raid_id, submitter)
+        if key in attendance_ids:
+            duplicate_ids.append(attendance_ids[key])
+        attendance_ids[key] = attendance_id
+    for start_index in range(0, len(duplicate_ids), 500):
+        Attendance.objects.filter(id__in=duplicate_ids[start_index:start_index + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0022_raid_change_seq'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gym',
+            name='pogo_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.RunPython(remove_duplicate_attendances, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='attendance',
+            unique_together=set([('raid', 'submitter')]),
+        ),
+        migrations.AddIndex(
+            model_name='raid',
+            index=models.Index(fields=['start_at'], name='raidikalu_r_start_a_2afb3d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='raid',
+            index=models.Index(fields=['end_at'], name='raidikalu_r_end_at_4d4834_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='raidvote',
+            index=models.Index(fields=['raid', 'vote_field', 'submitter'], name='raidikalu_r_raid_id_299e8a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='raidvote',
+            index=models.Index(fields=['raid', 'data_source', 'vote_field'], name='raidikalu_r_raid_id_34985c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='raidvote',
+            index=models.Index(fields=['data_source', 'vote_field', 'raid'], name='raidikalu_r_data_so_409d16_idx'),
+        ),
+    ]
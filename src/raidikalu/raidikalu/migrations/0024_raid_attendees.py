@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:58
+from __future__ import unicode_literals
+
+import json
+from calendar import timegm
+from datetime import timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def get_start_time_choices(start_at):
+    # Same as Raid.compute_start_time_choices at the time of this migration
+    if not start_at:
+        return []
+    if start_at.minute % 10 > 5:
+        start_offset_minutes = 15 - start_at.minute % 10
+    else:
+        start_offset_minutes = 10 - start_at.minute % 10
+    start_offset = start_at + timedelta(minutes=start_offset_minutes)
+    return [start_at] + [start_offset + timedelta(minutes=minutes) for minutes in (0, 10, 20, 30)]
+
+
+def fill_raid_attendees(apps, schema_editor):
+    Raid = apps.get_model('raidikalu', 'Raid')
+    Attendance = apps.get_model('raidikalu', 'Attendance')
+
+    # Ended raids are not shown anymore, so only the current ones are filled in
+    raids = Raid.objects.exclude(end_at__lte=timezone.now())
+    for raid in raids.only('id', 'start_at'):
+        attendees = []
+        for submitter, start_time_choice in Attendance.objects.filter(raid_id=raid.id).order_by('id').values_list('submitter', 'start_time_choice'):
+            attendees.extend([] for choice_index in range(len(attendees), start_time_choice + 1))
+            attendees[start_time_choice].append(submitter)
+        Raid.objects.filter(id=raid.id).update(
+            start_time_choices_json=json.dumps([timegm(choice.utctimetuple()) for choice in get_start_time_choices(raid.start_at)]),
+            attendees_json=json.dumps(attendees),
+            attendance_count=sum(len(choice_attendees) for choice_attendees in attendees),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0023_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='raid',
+            name='attendance_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='raid',
+            name='attendees_json',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='raid',
+            name='start_time_choices_json',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(fill_raid_attendees, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:10
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0024_raid_attendees'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='raidtype',
+            options={'ordering': ['-tier', '-priority']},
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raidikalu', '0025_raidtype_ordering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedRaidData',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raid_data', models.TextField()),
+                ('received_at', models.DateTimeField()),
+                ('failed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('attempt_count', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('data_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='failed_raid_data', to='raidikalu.DataSource')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pendingraiddata',
+            name='attempt_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
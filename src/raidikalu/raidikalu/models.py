@@ -1,13 +1,17 @@
 
+import json
 import logging
+import threading
+from calendar import timegm
 from datetime import timedelta, datetime
-from django.db import models
-from django.db.models import Count
+from functools import partial
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_save
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from raidikalu import settings
 from raidikalu.bestiary import get_monster_number_by_name
-from raidikalu.utils import format_timedelta
+from raidikalu.utils import bump_cache_version, bump_cache_version_on_commit, encode_geohash, format_timedelta, get_cache_version
 
 
 LOG = logging.getLogger(__name__)
@@ -38,7 +42,7 @@ class InfoBox(models.Model):
 
 class DataSource(models.Model):
   name = models.CharField(max_length=255)
-  api_key = models.CharField(max_length=2048)
+  api_key = models.CharField(max_length=2048, db_index=True)
 
   def __str__(self):
     return self.name
@@ -46,9 +50,10 @@ class DataSource(models.Model):
 
 class Gym(TimestampedModel):
   name = models.CharField(max_length=2048)
-  pogo_id = models.CharField(max_length=255, blank=True)
+  pogo_id = models.CharField(max_length=255, blank=True, db_index=True)
   latitude = models.DecimalField(max_digits=9, decimal_places=6)
   longitude = models.DecimalField(max_digits=9, decimal_places=6)
+  geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
   image_url = models.CharField(max_length=2048, blank=True)
   is_ex_eligible = models.BooleanField(default=False)
   is_active = models.BooleanField(default=True)
@@ -56,6 +61,10 @@ class Gym(TimestampedModel):
   def __str__(self):
     return self.name
 
+  def save(self, *args, **kwargs):
+    self.geohash = encode_geohash(self.latitude, self.longitude)
+    return super(Gym, self).save(*args, **kwargs)
+
 
 class GymNickname(TimestampedModel):
   gym = models.ForeignKey(Gym, related_name='nicknames', on_delete=models.CASCADE)
@@ -99,6 +108,65 @@ class RaidType(models.Model):
     return '\u2013'
 
 
+class RaidTypeRegistry(object):
+  # Raid types change only a few times a month, so every process keeps them in memory
+  # and reloads them when a raid type change bumps the version in the cache
+  VERSION_CACHE_KEY = 'raidikalu_raid_type_version'
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.version = None
+    self.raid_types = []
+    self.raid_types_by_pk = {}
+    self.raid_types_by_name = {}
+    self.raid_types_by_number = {}
+
+  def sync(self):
+    version = get_cache_version(self.VERSION_CACHE_KEY)
+    if version == self.version:
+      return
+    with self.lock:
+      if version == self.version:
+        return
+      raid_types = list(RaidType.objects.order_by('-tier', '-priority'))
+      raid_types_by_name = {}
+      raid_types_by_number = {}
+      # Active raid types are preferred when several share a name or number
+      for raid_type in sorted(raid_types, key=lambda raid_type: not raid_type.is_active):
+        raid_types_by_name.setdefault(raid_type.monster_name, raid_type)
+        if raid_type.monster_number:
+          raid_types_by_number.setdefault(raid_type.monster_number, raid_type)
+      self.raid_types = raid_types
+      self.raid_types_by_pk = {raid_type.pk: raid_type for raid_type in raid_types}
+      self.raid_types_by_name = raid_types_by_name
+      self.raid_types_by_number = raid_types_by_number
+      self.version = version
+
+  def get_active(self):
+    self.sync()
+    return [raid_type for raid_type in self.raid_types if raid_type.is_active]
+
+  def get_by_pk(self, pk):
+    self.sync()
+    return self.raid_types_by_pk.get(pk, None)
+
+  def get_by_name(self, monster_name):
+    self.sync()
+    return self.raid_types_by_name.get(monster_name, None)
+
+  def get_by_number(self, monster_number):
+    self.sync()
+    return self.raid_types_by_number.get(monster_number, None)
+
+  @classmethod
+  def invalidate(cls, **kwargs):
+    bump_cache_version_on_commit(cls.VERSION_CACHE_KEY)
+
+
+raid_type_registry = RaidTypeRegistry()
+pending_change_seqs = threading.local()
+
+
 class Raid(TimestampedModel):
   RAID_EGG_DURATION = timedelta(hours=1)
   RAID_BATTLE_DURATION = timedelta(minutes=45)
@@ -115,21 +183,154 @@ class Raid(TimestampedModel):
   charge_move = models.CharField(max_length=255, blank=True)
   start_at = models.DateTimeField(null=True, blank=True)
   end_at = models.DateTimeField(null=True, blank=True)
+  # True for the current raid of the gym and None for the rest, which the unique
+  # constraint allows any number of
+  is_active = models.NullBooleanField(default=True, editable=False)
+  # Grows on every save, for exporting the raids changed since a cursor
+  change_seq = models.BigIntegerField(default=0, db_index=True, editable=False)
+  # Timestamps of the start time choices, and the attendees of each choice. The attendees
+  # are kept up to date by Attendance writes, so that showing a raid needs no attendance rows.
+  start_time_choices_json = models.TextField(blank=True, editable=False)
+  attendees_json = models.TextField(blank=True, editable=False)
+  attendance_count = models.PositiveIntegerField(default=0, editable=False)
+
+  CHANGE_SEQUENCE_CACHE_KEY = 'raidikalu_raid_change_sequence'
+  ATTENDANCE_FIELDS = ('attendees_json', 'attendance_count')
+
+  class Meta:
+    unique_together = [('gym', 'is_active')]
+    indexes = [
+      # The raid list is ordered by start time and the reaper looks up ended raids
+      models.Index(fields=['start_at']),
+      models.Index(fields=['end_at']),
+    ]
 
   def save(self, *args, **kwargs):
+    self.update_derived_fields()
+    if not self._state.adding and 'update_fields' not in kwargs:
+      # The attendees may have changed since this raid was loaded, is_active is changed
+      # only by get_or_create_active when the raid is replaced, and change_seq only once
+      # the save is committed, so they are not saved over
+      kwargs['update_fields'] = [
+        field.name for field in self._meta.concrete_fields
+        if not field.primary_key and field.name not in Raid.ATTENDANCE_FIELDS + ('is_active', 'change_seq')
+      ]
+    result = super(Raid, self).save(*args, **kwargs)
+    Raid.stamp_change_seqs_on_commit([self.pk])
+    return result
+
+  @classmethod
+  def stamp_change_seqs_on_commit(cls, raid_ids):
+    # The change feed reads raids in sequence order. Numbers taken before the commit
+    # could become visible out of order after a long transaction, and the feed would
+    # pass them by, so the raids saved in a transaction are numbered once it commits.
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+      cls.stamp_change_seqs(raid_ids)
+      return
+    hook = getattr(pending_change_seqs, 'hook', None)
+    # A rolled back transaction or savepoint drops its hooks, and with them its raids
+    if hook is None or not any(func is hook for sids, func in connection.run_on_commit):
+      hook = partial(cls.stamp_change_seqs, set())
+      pending_change_seqs.hook = hook
+      transaction.on_commit(hook)
+    hook.args[0].update(raid_ids)
+
+  @classmethod
+  def stamp_change_seqs(cls, raid_ids):
+    # Numbers the raids with one statement. updated_at is stamped too, for the settle
+    # time of the feed.
+    raid_ids = sorted(raid_ids)
+    if not raid_ids:
+      return
+    first_change_seq = bump_cache_version(cls.CHANGE_SEQUENCE_CACHE_KEY, len(raid_ids)) - len(raid_ids) + 1
+    cls.objects.filter(pk__in=raid_ids).update(
+      change_seq=models.Case(*[
+        models.When(pk=raid_id, then=models.Value(first_change_seq + index))
+        for index, raid_id in enumerate(raid_ids)
+      ], output_field=models.BigIntegerField()),
+      updated_at=timezone.now(),
+    )
+
+  @classmethod
+  def get_or_create_active(cls, gym, defaults=None, retries=3):
+    # Returns the current raid of the gym, or creates one if the gym has none or its raid
+    # has ended. When two requests race, the database lets only one of them create the
+    # raid and the other one finds it on the next attempt.
+    for attempt in range(retries):
+      raid = cls.objects.filter(gym=gym, is_active=True).first()
+      if raid and not (raid.end_at and raid.end_at <= timezone.now()):
+        return raid, False
+      try:
+        with transaction.atomic():
+          if raid:
+            cls.objects.filter(pk=raid.pk, is_active=True).update(is_active=None)
+          raid = cls(gym=gym, **(defaults or {}))
+          raid.save()
+        return raid, True
+      except IntegrityError:
+        if attempt == retries - 1:
+          raise
+        LOG.info('Raid was created concurrently, retrying', extra={'data': {'gym': gym.pk, 'attempt': attempt}})
+
+  @classmethod
+  def create_active_raids(cls, raids):
+    # Creates the given unsaved raids as the current raids of their gyms with one insert,
+    # and returns them with whether each was created. If another request created a raid
+    # for one of the gyms meanwhile, the raids are looked up or created one at a time.
+    now = timezone.now()
+    gym_ids = [raid.gym_id for raid in raids]
+    for raid in raids:
+      raid.updated_at = now
+      raid.update_derived_fields()
+    try:
+      with transaction.atomic():
+        # Ended raids still hold the active slot of their gym until they are replaced
+        cls.objects.filter(gym_id__in=gym_ids, is_active=True, end_at__lte=now).update(is_active=None)
+        cls.objects.bulk_create(raids)
+    except IntegrityError:
+      LOG.info('Raids were created concurrently, creating one at a time', extra={'data': {'gyms': gym_ids}})
+      return [cls.get_or_create_active(raid.gym, defaults={'data_source': raid.data_source}) for raid in raids]
+    if any(raid.pk is None for raid in raids):
+      # Only some databases return the primary keys of a bulk insert
+      raid_ids_by_gym_id = dict(cls.objects.filter(gym_id__in=gym_ids, is_active=True).values_list('gym_id', 'pk'))
+      for raid in raids:
+        raid.pk = raid_ids_by_gym_id[raid.gym_id]
+    for raid in raids:
+      raid._state.adding = False
+      raid._state.db = cls.objects.db
+      # The bulk insert skips the save signals, which broadcast the raid and drop the caches
+      post_save.send(sender=cls, instance=raid, created=True, update_fields=None, raw=False, using=raid._state.db)
+    cls.stamp_change_seqs_on_commit([raid.pk for raid in raids])
+    return [(raid, True) for raid in raids]
+
+  def update_derived_fields(self):
+    if self.raid_type_id:
+      self.raid_type = raid_type_registry.get_by_pk(self.raid_type_id) or self.raid_type
     if self.raid_type:
       self.tier = self.raid_type.tier
       self.monster_name = self.raid_type.monster_name
     elif not self.raid_type and self.monster_name:
-      try:
-        self.raid_type = RaidType.objects.get(monster_name=self.monster_name)
+      # The raid type may spell the name differently
+      self.raid_type = (
+        raid_type_registry.get_by_name(self.monster_name) or
+        raid_type_registry.get_by_number(get_monster_number_by_name(self.monster_name))
+      )
+      if self.raid_type:
         self.tier = self.raid_type.tier
-      except RaidType.DoesNotExist:
+        self.monster_name = self.raid_type.monster_name
+      else:
         LOG.error('Could not find raid type for raid', extra={'data': {'raid_monster_name': repr(self.monster_name)}})
     self.end_at = self.start_at + Raid.RAID_BATTLE_DURATION if self.start_at else None
     self.unverified_text = self.get_unverified_text()
-    Raid.objects.filter(end_at__lt=timezone.now()).delete()
-    return super(Raid, self).save(*args, **kwargs)
+    self.start_time_choices_json = json.dumps([timegm(choice.utctimetuple()) for choice in self.compute_start_time_choices()])
+    self._start_time_choices = None
+
+  def get_state(self):
+    return (
+      self.tier, self.monster_name, self.raid_type_id, self.fast_move, self.charge_move,
+      self.start_at, self.end_at, self.unverified_text,
+    )
 
   @property
   def has_started(self):
@@ -138,8 +339,10 @@ class Raid(TimestampedModel):
     return False
 
   def get_image_url(self):
-    if self.raid_type:
-      return self.raid_type.get_image_url()
+    # The raid type is looked up from the registry, so that listing raids does not query each one
+    raid_type = raid_type_registry.get_by_pk(self.raid_type_id) if self.raid_type_id else None
+    if raid_type:
+      return raid_type.get_image_url()
     else:
       return ''
 
@@ -156,6 +359,12 @@ class Raid(TimestampedModel):
     return format_timedelta(self.get_time_left_until_end()) if self.end_at else '\u2013'
 
   def get_start_time_choices(self):
+    if getattr(self, '_start_time_choices', None) is None:
+      timestamps = json.loads(self.start_time_choices_json) if self.start_time_choices_json else []
+      self._start_time_choices = [datetime.fromtimestamp(timestamp, timezone.utc) for timestamp in timestamps]
+    return self._start_time_choices
+
+  def compute_start_time_choices(self):
     start_time_choices = []
     if self.start_at:
       # The first start time choice should be at least 5 minutes in the future
@@ -174,6 +383,49 @@ class Raid(TimestampedModel):
       ]
     return start_time_choices
 
+  def get_attendees(self):
+    return json.loads(self.attendees_json) if self.attendees_json else []
+
+  def get_start_times_with_attendances(self):
+    attendees = self.get_attendees()
+    start_times_with_attendances = []
+    for choice_index, start_time_choice in enumerate(self.get_start_time_choices()):
+      start_times_with_attendances.append({
+        'time': start_time_choice,
+        'attendees': attendees[choice_index] if choice_index < len(attendees) else [],
+      })
+    return start_times_with_attendances
+
+  def update_attendees(self, submitter, start_time_choice):
+    # Moves the submitter to the start time choice, or removes them when the choice is None.
+    # The raid row is locked meanwhile, so that concurrent attendances are not lost.
+    with transaction.atomic(savepoint=False):
+      self.attendees_json = Raid.objects.select_for_update().filter(pk=self.pk).values_list('attendees_json', flat=True).get()
+      attendees = [[attendee for attendee in choice_attendees if attendee != submitter] for choice_attendees in self.get_attendees()]
+      if start_time_choice is not None:
+        Raid.add_attendee(attendees, submitter, start_time_choice)
+      self.attendees_json = json.dumps(attendees)
+      self.attendance_count = sum(len(choice_attendees) for choice_attendees in attendees)
+      Raid.objects.filter(pk=self.pk).update(attendees_json=self.attendees_json, attendance_count=self.attendance_count)
+
+  @staticmethod
+  def add_attendee(attendees, submitter, start_time_choice):
+    attendees.extend([] for choice_index in range(len(attendees), start_time_choice + 1))
+    attendees[start_time_choice].append(submitter)
+
+  @classmethod
+  def rebuild_attendees(cls, raid_ids):
+    # For when attendances are changed in bulk, bypassing their save and delete
+    attendees_by_raid_id = {raid_id: [] for raid_id in raid_ids}
+    attendances = Attendance.objects.filter(raid_id__in=raid_ids).order_by('pk').values_list('raid_id', 'submitter', 'start_time_choice')
+    for raid_id, submitter, start_time_choice in attendances:
+      cls.add_attendee(attendees_by_raid_id[raid_id], submitter, start_time_choice)
+    for raid_id, attendees in attendees_by_raid_id.items():
+      cls.objects.filter(pk=raid_id).update(
+        attendees_json=json.dumps(attendees),
+        attendance_count=sum(len(choice_attendees) for choice_attendees in attendees),
+      )
+
   def get_tier_display(self):
     if self.tier == 1:
       return '\u2605'
@@ -187,9 +439,17 @@ class Raid(TimestampedModel):
       return '\u2605\u2605\u2605\u2605\u2605'
     return '\u2013'
 
+  def get_vote_tallies(self, vote_field):
+    if getattr(self, '_vote_tallies', None) is None:
+      self._vote_tallies = {}
+      if self.pk:
+        for tally in self.vote_tallies.all():
+          self._vote_tallies.setdefault(tally.vote_field, []).append(tally)
+    return self._vote_tallies.get(vote_field, [])
+
   def get_unverified_text(self):
-    is_monster_unverified = RaidVote.get_confidence(self, RaidVote.FIELD_MONSTER) < 3
-    is_tier_unverified = RaidVote.get_confidence(self, RaidVote.FIELD_TIER) < 3
+    is_monster_unverified = RaidVoteTally.get_confidence(self, RaidVote.FIELD_MONSTER) < 3
+    is_tier_unverified = RaidVoteTally.get_confidence(self, RaidVote.FIELD_TIER) < 3
     if is_monster_unverified and is_tier_unverified:
       return _('raid existence')
     if is_monster_unverified:
@@ -197,31 +457,46 @@ class Raid(TimestampedModel):
     return ''
 
   def count_votes_and_update(self):
-    tier = RaidVote.get_top_value(self, RaidVote.FIELD_TIER)
+    # Returns whether the raid changed. An unchanged raid is not saved, so that
+    # repeated reports do not cause writes and broadcasts.
+    self._vote_tallies = None
+    previous_state = self.get_state() if self.pk else None
+    self.set_vote_values({
+      vote_field: RaidVoteTally.get_top_value(self, vote_field)
+      for vote_field in (RaidVote.FIELD_TIER, RaidVote.FIELD_MONSTER, RaidVote.FIELD_FAST_MOVE, RaidVote.FIELD_CHARGE_MOVE, RaidVote.FIELD_START_AT)
+    })
+    self.update_derived_fields()
+    if self.get_state() == previous_state:
+      return False
+    self.save()
+    return True
+
+  def set_vote_values(self, vote_values):
+    # Sets the fields from the winning value of each vote field, leaving the fields
+    # without votes as they are
+    tier = vote_values.get(RaidVote.FIELD_TIER, None)
     if tier is not None:
       self.tier = int(tier)
 
-    monster_name = RaidVote.get_top_value(self, RaidVote.FIELD_MONSTER)
+    monster_name = vote_values.get(RaidVote.FIELD_MONSTER, None)
     if monster_name is not None:
       self.monster_name = monster_name
 
-    fast_move = RaidVote.get_top_value(self, RaidVote.FIELD_FAST_MOVE)
+    fast_move = vote_values.get(RaidVote.FIELD_FAST_MOVE, None)
     if fast_move is not None:
       self.fast_move = fast_move
 
-    charge_move = RaidVote.get_top_value(self, RaidVote.FIELD_CHARGE_MOVE)
+    charge_move = vote_values.get(RaidVote.FIELD_CHARGE_MOVE, None)
     if charge_move is not None:
       self.charge_move = charge_move
 
-    start_timestamp = RaidVote.get_top_value(self, RaidVote.FIELD_START_AT)
+    start_timestamp = vote_values.get(RaidVote.FIELD_START_AT, None)
     if start_timestamp is not None:
       start_timestamp = int(start_timestamp)
       start_at = datetime.fromtimestamp(start_timestamp)
       start_at = timezone.make_aware(start_at, timezone.get_current_timezone())
       self.start_at = start_at
 
-    self.save()
-
   def __str__(self):
     return '%s // %s' % (self.gym.name, self.monster_name)
 
@@ -245,40 +520,175 @@ class RaidVote(TimestampedModel):
   vote_value = models.CharField(max_length=255)
   data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE, null=True, blank=True)
 
+  class Meta:
+    indexes = [
+      # Earlier votes of a submitter when tallying, votes of a data source when ingesting,
+      # and the raids a data source has reported when exporting
+      models.Index(fields=['raid', 'vote_field', 'submitter']),
+      models.Index(fields=['raid', 'data_source', 'vote_field']),
+      models.Index(fields=['data_source', 'vote_field', 'raid']),
+    ]
+
+  def save(self, *args, **kwargs):
+    is_new = self.pk is None
+    with transaction.atomic(savepoint=False):
+      if is_new:
+        super(RaidVote, self).save(*args, **kwargs)
+        RaidVoteTally.record_votes([self])
+        return
+      previous_keys = list(RaidVote.objects.filter(pk=self.pk).values_list('raid_id', 'vote_field'))
+      super(RaidVote, self).save(*args, **kwargs)
+      RaidVote.votes_changed(previous_keys + [(self.raid_id, self.vote_field)])
+
+  def delete(self, *args, **kwargs):
+    with transaction.atomic(savepoint=False):
+      result = super(RaidVote, self).delete(*args, **kwargs)
+      RaidVote.votes_changed([(self.raid_id, self.vote_field)])
+      return result
+
+  @classmethod
+  def votes_changed(cls, keys):
+    # Recounts the tallies of edited or deleted votes and updates their raids
+    keys = set(keys)
+    RaidVoteTally.recount(keys)
+    for raid in Raid.objects.filter(pk__in=set(raid_id for raid_id, vote_field in keys)):
+      raid.count_votes_and_update()
+
+  def __str__(self):
+    return '%s // %s // %s' % (self.raid, self.vote_field, self.vote_value)
+
+
+class RaidVoteTally(models.Model):
+  raid = models.ForeignKey(Raid, related_name='vote_tallies', on_delete=models.CASCADE)
+  vote_field = models.CharField(max_length=255, choices=RaidVote.FIELD_CHOICES)
+  vote_value = models.CharField(max_length=255)
+  vote_count = models.PositiveIntegerField(default=0)
+  # Only the first vote of each submitter is counted here, one for anonymous
+  submitter_count = models.PositiveIntegerField(default=0)
+  last_vote_at = models.DateTimeField(null=True, blank=True)
+  data_source_vote_at = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    unique_together = ('raid', 'vote_field', 'vote_value')
+
+  @classmethod
+  def record_votes(cls, votes):
+    with transaction.atomic(savepoint=False):
+      counted_submitters = cls.get_earlier_submitters(votes)
+      increments = {}
+      for vote in votes:
+        key = (vote.raid_id, vote.vote_field, str(vote.vote_value))
+        increment = increments.setdefault(key, {
+          'vote_count': 0,
+          'submitter_count': 0,
+          'last_vote_at': None,
+          'data_source_vote_at': None,
+        })
+        increment['vote_count'] += 1
+        increment['last_vote_at'] = max(filter(None, [increment['last_vote_at'], vote.created_at]))
+        submitter_key = (vote.raid_id, vote.vote_field, vote.submitter)
+        if vote.data_source_id:
+          # Data source votes always win, so counting their submitters is not needed
+          increment['data_source_vote_at'] = max(filter(None, [increment['data_source_vote_at'], vote.created_at]))
+        elif submitter_key not in counted_submitters:
+          increment['submitter_count'] += 1
+        counted_submitters.add(submitter_key)
+
+      if not increments:
+        return
+
+      raid_ids = set(key[0] for key in increments)
+      existing_tallies = {}
+      for tally in cls.objects.filter(raid_id__in=raid_ids):
+        existing_tallies[(tally.raid_id, tally.vote_field, tally.vote_value)] = tally
+
+      new_tallies = []
+      updates = {}
+      for key, increment in increments.items():
+        if key in existing_tallies:
+          update_key = tuple(sorted(increment.items()))
+          updates.setdefault(update_key, []).append(existing_tallies[key].pk)
+        else:
+          raid_id, vote_field, vote_value = key
+          new_tallies.append(cls(raid_id=raid_id, vote_field=vote_field, vote_value=vote_value, **increment))
+
+      # Identical increments are applied with a single update statement
+      for update_key, tally_ids in updates.items():
+        increment = dict(update_key)
+        update_kwargs = {
+          'vote_count': models.F('vote_count') + increment['vote_count'],
+          'submitter_count': models.F('submitter_count') + increment['submitter_count'],
+          'last_vote_at': increment['last_vote_at'],
+        }
+        if increment['data_source_vote_at']:
+          update_kwargs['data_source_vote_at'] = increment['data_source_vote_at']
+        cls.objects.filter(pk__in=tally_ids).update(**update_kwargs)
+
+      try:
+        with transaction.atomic():
+          cls.objects.bulk_create(new_tallies)
+      except IntegrityError:
+        # Someone else created some of the tallies concurrently, retry those through the update path
+        cls.record_votes([vote for vote in votes if (vote.raid_id, vote.vote_field, str(vote.vote_value)) not in existing_tallies])
+
+  @classmethod
+  def get_earlier_submitters(cls, votes):
+    # Returns the (raid, field, submitter) of the other votes on the fields the submitters
+    # vote on, with one query. The raids are locked first, so that two concurrent votes of
+    # the same submitter cannot both be counted as their first.
+    user_votes = [vote for vote in votes if not vote.data_source_id]
+    if not user_votes:
+      return set()
+    raid_ids = sorted(set(vote.raid_id for vote in user_votes))
+    list(Raid.objects.select_for_update().filter(pk__in=raid_ids).order_by('pk').values_list('pk', flat=True))
+    earlier_votes = RaidVote.objects.filter(
+      raid_id__in=raid_ids,
+      vote_field__in=set(vote.vote_field for vote in user_votes),
+      submitter__in=set(vote.submitter for vote in user_votes),
+    ).exclude(pk__in=[vote.pk for vote in votes if vote.pk])
+    return set(earlier_votes.values_list('raid_id', 'vote_field', 'submitter'))
+
+  @classmethod
+  def recount(cls, keys):
+    # Rebuilds the tallies of the (raid, field) pairs from their votes, for when votes are
+    # edited or deleted, which the incremental tallies cannot follow
+    keys = set(keys)
+    if not keys:
+      return
+    query = models.Q()
+    for raid_id, vote_field in keys:
+      query |= models.Q(raid_id=raid_id, vote_field=vote_field)
+    with transaction.atomic(savepoint=False):
+      cls.objects.filter(query).delete()
+      cls.record_votes(list(RaidVote.objects.filter(query).order_by('pk')))
+
   @classmethod
   def get_top_value(cls, raid, vote_field):
-    try:
-      return RaidVote.objects.filter(raid=raid, vote_field=vote_field, data_source__isnull=False).latest('created_at').vote_value
-    except RaidVote.DoesNotExist:
-      qs = RaidVote.objects.filter(raid=raid, vote_field=vote_field)
-      qs = qs.values('vote_value').annotate(count=Count('vote_value')).order_by('-count', '-created_at')
-      top_vote = qs.first()
-      if top_vote:
-        return top_vote['vote_value']
+    tallies = raid.get_vote_tallies(vote_field)
+    data_source_tallies = [tally for tally in tallies if tally.data_source_vote_at]
+    if data_source_tallies:
+      return max(data_source_tallies, key=lambda tally: tally.data_source_vote_at).vote_value
+    if tallies:
+      return max(tallies, key=lambda tally: (tally.vote_count, tally.last_vote_at)).vote_value
     return None
 
   @classmethod
   def get_confidence(cls, raid, vote_field):
+    tallies = raid.get_vote_tallies(vote_field)
+    if any(tally.data_source_vote_at for tally in tallies):
+      return 100
+    raid_value = getattr(raid, vote_field)
+    raid_value = str(raid_value) if raid_value is not None else ''
     confidence = 0
-    if RaidVote.objects.filter(raid=raid, vote_field=vote_field, data_source__isnull=False).exists():
-      confidence = 100
-    else:
-      votes = RaidVote.objects.filter(raid=raid, vote_field=vote_field)
-      raid_value = getattr(raid, vote_field)
-      submitters = []
-      for vote in votes:
-        # Count only one vote per submitter, one for anonymous
-        if vote.submitter in submitters:
-          continue
-        submitters.append(vote.submitter)
-        if raid_value == vote.vote_value:
-          confidence += 1
-        else:
-          confidence -= 1
+    for tally in tallies:
+      if tally.vote_value == raid_value:
+        confidence += tally.submitter_count
+      else:
+        confidence -= tally.submitter_count
     return confidence
 
   def __str__(self):
-    return '%s // %s // %s' % (self.raid, self.vote_field, self.vote_value)
+    return '%s // %s // %s' % (self.raid_id, self.vote_field, self.vote_value)
 
 
 class Attendance(TimestampedModel):
@@ -286,5 +696,84 @@ class Attendance(TimestampedModel):
   submitter = models.CharField(max_length=255)
   start_time_choice = models.PositiveSmallIntegerField()
 
+  class Meta:
+    unique_together = [('raid', 'submitter')]
+
+  def save(self, *args, **kwargs):
+    with transaction.atomic(savepoint=False):
+      self.raid.update_attendees(self.submitter, self.start_time_choice)
+      return super(Attendance, self).save(*args, **kwargs)
+
+  def delete(self, *args, **kwargs):
+    with transaction.atomic(savepoint=False):
+      self.raid.update_attendees(self.submitter, None)
+      return super(Attendance, self).delete(*args, **kwargs)
+
   def __str__(self):
     return '%s // ' % self.raid
+
+
+class RaidHistory(models.Model):
+  gym = models.ForeignKey(Gym, related_name='raid_history', on_delete=models.CASCADE)
+  data_source = models.ForeignKey(DataSource, on_delete=models.SET_NULL, null=True, blank=True)
+  tier = models.PositiveSmallIntegerField(null=True, blank=True)
+  monster_number = models.PositiveSmallIntegerField(null=True, blank=True)
+  start_at = models.DateTimeField()
+  end_at = models.DateTimeField()
+  attendance_count = models.PositiveIntegerField(default=0)
+
+  class Meta:
+    verbose_name_plural = 'raid history'
+    indexes = [
+      models.Index(fields=['gym', 'start_at']),
+      models.Index(fields=['start_at']),
+    ]
+
+  @classmethod
+  def archive_raids(cls, raid_ids):
+    raids = Raid.objects.filter(pk__in=raid_ids, start_at__isnull=False, end_at__isnull=False)
+    raids = raids.values('gym_id', 'data_source_id', 'tier', 'monster_name', 'raid_type__monster_number', 'start_at', 'end_at', 'attendance_count')
+    history = []
+    for raid in raids:
+      monster_number = raid['raid_type__monster_number']
+      if not monster_number and raid['monster_name']:
+        monster_number = get_monster_number_by_name(raid['monster_name'])
+      history.append(cls(
+        gym_id=raid['gym_id'],
+        data_source_id=raid['data_source_id'],
+        tier=raid['tier'],
+        monster_number=monster_number,
+        start_at=raid['start_at'],
+        end_at=raid['end_at'],
+        attendance_count=raid['attendance_count'],
+      ))
+    cls.objects.bulk_create(history)
+    return len(history)
+
+  def __str__(self):
+    return '%s // %s // %s' % (self.gym_id, self.monster_number, self.start_at)
+
+
+class PendingRaidData(models.Model):
+  # Raid data received from a data source and waiting to be ingested by a worker
+  data_source = models.ForeignKey(DataSource, related_name='pending_raid_data', on_delete=models.CASCADE)
+  raid_data = models.TextField()
+  received_at = models.DateTimeField(default=timezone.now, db_index=True)
+  attempt_count = models.PositiveSmallIntegerField(default=0)
+
+  def __str__(self):
+    return '%s // %s' % (self.data_source_id, self.received_at)
+
+
+class FailedRaidData(models.Model):
+  # Queued raid data that could not be ingested in the allowed number of attempts,
+  # kept aside so that it does not block the queue and can be looked into
+  data_source = models.ForeignKey(DataSource, related_name='failed_raid_data', on_delete=models.CASCADE)
+  raid_data = models.TextField()
+  received_at = models.DateTimeField()
+  failed_at = models.DateTimeField(default=timezone.now, db_index=True)
+  attempt_count = models.PositiveSmallIntegerField(default=0)
+  error = models.TextField(blank=True)
+
+  def __str__(self):
+    return '%s // %s' % (self.data_source_id, self.failed_at)
@@ -0,0 +1,99 @@
+import re
+import traceback
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorWrapper
+from raidikalu import settings
+
+
+IN_LIST_REGEX = re.compile(r'IN \(%s(?:, %s)*\)')
+STACK_FRAME_COUNT = 6
+
+
+def get_query_shape(sql):
+  # Queries that differ only by their parameters or the length of an IN list have the same shape
+  return IN_LIST_REGEX.sub('IN (...)', sql)
+
+
+def get_app_stack():
+  # The frames of this app that led to the query, leaving out Django and this module
+  frames = [
+    frame for frame in traceback.extract_stack()[:-3]
+    if '/raidikalu/' in frame.filename and frame.filename != __file__
+  ]
+  return traceback.format_list(frames[-STACK_FRAME_COUNT:])
+
+
+class RecordingCursorWrapper(CursorWrapper):
+  def __init__(self, cursor, db, recorder):
+    super(RecordingCursorWrapper, self).__init__(cursor, db)
+    self.recorder = recorder
+
+  def execute(self, sql, params=None):
+    self.recorder.record(sql)
+    return super(RecordingCursorWrapper, self).execute(sql, params)
+
+  def executemany(self, sql, param_list):
+    self.recorder.record(sql)
+    return super(RecordingCursorWrapper, self).executemany(sql, param_list)
+
+
+class QueryRecorder(object):
+  # Records the SQL run on the default database connection of this thread, with the
+  # app frames that ran each query. Recorders can be nested.
+  def __init__(self, using=DEFAULT_DB_ALIAS):
+    self.using = using
+    self.queries = []
+
+  def __enter__(self):
+    self.queries = []
+    self.connection = connections[self.using]
+    self.previous_make_cursor = self.connection.__dict__.get('make_debug_cursor', None)
+    self.previous_force_debug_cursor = self.connection.force_debug_cursor
+    self.connection.make_debug_cursor = self.make_cursor
+    self.connection.force_debug_cursor = True
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if self.previous_make_cursor:
+      self.connection.make_debug_cursor = self.previous_make_cursor
+    else:
+      del self.connection.make_debug_cursor
+    self.connection.force_debug_cursor = self.previous_force_debug_cursor
+
+  def make_cursor(self, cursor):
+    if self.previous_make_cursor:
+      cursor = self.previous_make_cursor(cursor)
+    return RecordingCursorWrapper(cursor, self.connection, self)
+
+  def record(self, sql):
+    self.queries.append((sql, get_app_stack()))
+
+  def get_repeated_queries(self, threshold):
+    # Returns (count, shape, stack of the first query) for the reads run at least threshold
+    # times. Writes are left out, as every changed row is expected to be saved.
+    shapes = {}
+    for sql, stack in self.queries:
+      if not sql.lstrip().upper().startswith('SELECT'):
+        continue
+      shape = get_query_shape(sql)
+      count, first_stack = shapes.get(shape, (0, stack))
+      shapes[shape] = (count + 1, first_stack)
+    repeated_queries = [(count, shape, stack) for shape, (count, stack) in shapes.items() if count >= threshold]
+    repeated_queries.sort(key=lambda repeated_query: -repeated_query[0])
+    return repeated_queries
+
+
+def get_query_budget(url_name):
+  return settings.QUERY_BUDGETS.get(url_name, None)
+
+
+def get_query_problems(url_name, recorder):
+  # Returns descriptions of the budget being exceeded and of the repeated queries,
+  # which are what N+1 problems look like
+  problems = []
+  budget = get_query_budget(url_name)
+  if budget is not None and len(recorder.queries) > budget:
+    problems.append('%s ran %s queries, the budget is %s' % (url_name, len(recorder.queries), budget))
+  for count, shape, stack in recorder.get_repeated_queries(settings.QUERY_REPEAT_THRESHOLD):
+    problems.append('%s ran the same query %s times: %s\n%s' % (url_name, count, shape, ''.join(stack).rstrip()))
+  return problems
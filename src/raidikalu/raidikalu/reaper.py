@@ -0,0 +1,74 @@
+import logging
+import time
+from calendar import timegm
+from django.db import models, router, transaction
+from django.utils import timezone
+from raidikalu import settings
+from raidikalu.models import Raid, RaidHistory
+from raidikalu.stats import increment_stat, set_stat
+from raidikalu.utils import bump_data_version
+
+
+LOG = logging.getLogger(__name__)
+
+
+def delete_raids(raid_ids):
+  # Deletes the raids and the rows depending on them with one query per table, without
+  # loading them or sending the delete signals. Returns the number of raids and of all
+  # rows deleted.
+  using = router.db_for_write(Raid)
+  deleted_rows = 0
+  for related_object in Raid._meta.related_objects:
+    related_field_name = related_object.field.name
+    related_rows = related_object.related_model._base_manager.filter(**{'%s__in' % related_field_name: raid_ids})
+    if related_object.on_delete is models.CASCADE:
+      deleted_rows += related_rows._raw_delete(using)
+    elif related_object.on_delete is models.SET_NULL:
+      related_rows.update(**{related_field_name: None})
+    else:
+      raise ValueError('Raids cannot be reaped while %s rows refer to them' % related_object.related_model.__name__)
+  deleted_raids = Raid.objects.filter(pk__in=raid_ids)._raw_delete(using)
+  return deleted_raids, deleted_rows + deleted_raids
+
+
+def reap_expired_raids(batch_size=None):
+  batch_size = batch_size or settings.REAPER_BATCH_SIZE
+  started_at = time.time()
+  now = timezone.now()
+  archived_raids = 0
+  deleted_raids = 0
+  deleted_rows = 0
+
+  while True:
+    raid_ids = list(Raid.objects.filter(end_at__lt=now).values_list('pk', flat=True)[:batch_size])
+    if not raid_ids:
+      break
+    with transaction.atomic():
+      archived_raids += RaidHistory.archive_raids(raid_ids)
+      batch_deleted_raids, batch_deleted_rows = delete_raids(raid_ids)
+      # Once per batch, as the delete signals that would bump it are not sent
+      bump_data_version()
+    deleted_raids += batch_deleted_raids
+    deleted_rows += batch_deleted_rows
+    if len(raid_ids) < batch_size:
+      break
+
+  duration = time.time() - started_at
+  increment_stat('reaper_runs')
+  increment_stat('reaper_archived_raids', archived_raids)
+  increment_stat('reaper_deleted_raids', deleted_raids)
+  increment_stat('reaper_deleted_rows', deleted_rows)
+  set_stat('reaper_last_archived_raids', archived_raids)
+  set_stat('reaper_last_deleted_raids', deleted_raids)
+  set_stat('reaper_last_deleted_rows', deleted_rows)
+  set_stat('reaper_last_duration', round(duration, 3))
+  set_stat('reaper_last_run_at', timegm(now.utctimetuple()))
+  if deleted_raids:
+    LOG.info('Reaped expired raids', extra={'data': {'raids': deleted_raids, 'archived': archived_raids, 'rows': deleted_rows, 'duration': duration}})
+
+  return {
+    'archived_raids': archived_raids,
+    'deleted_raids': deleted_raids,
+    'deleted_rows': deleted_rows,
+    'duration': duration,
+  }
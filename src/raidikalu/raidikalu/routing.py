@@ -1,9 +1,11 @@
 
 from channels.routing import route
-from raidikalu.consumers import ws_connect, ws_disconnect
+from raidikalu.consumers import ingest_queued_raids, ws_connect, ws_disconnect
+from raidikalu.ingestion import INGESTION_CHANNEL
 
 
 channel_routing = [
   route('websocket.connect', ws_connect),
   route('websocket.disconnect', ws_disconnect),
+  route(INGESTION_CHANNEL, ingest_queued_raids),
 ]
@@ -3,4 +3,53 @@ from django.conf import settings
 
 
 BASE_RAID_IMAGE_URL = getattr(settings, 'RAIDIKALU_BASE_RAID_IMAGE_URL', '/static/img/raidicons/%s.png')
+MONSTER_ALIASES = getattr(settings, 'RAIDIKALU_MONSTER_ALIASES', {})
 GOOGLE_ANALYTICS_ID = getattr(settings, 'GOOGLE_ANALYTICS_ID', None)
+REAPER_INTERVAL = getattr(settings, 'RAIDIKALU_REAPER_INTERVAL', 60)
+REAPER_BATCH_SIZE = getattr(settings, 'RAIDIKALU_REAPER_BATCH_SIZE', 100)
+SUBSCRIPTION_CELL_PRECISION = getattr(settings, 'RAIDIKALU_SUBSCRIPTION_CELL_PRECISION', 5)
+MAX_SUBSCRIPTION_GROUPS = getattr(settings, 'RAIDIKALU_MAX_SUBSCRIPTION_GROUPS', 50)
+EVENT_LOG_SIZE = getattr(settings, 'RAIDIKALU_EVENT_LOG_SIZE', 500)
+EVENT_LOG_TIMEOUT = getattr(settings, 'RAIDIKALU_EVENT_LOG_TIMEOUT', 60 * 60)
+EVENT_COALESCE_WINDOW = getattr(settings, 'RAIDIKALU_EVENT_COALESCE_WINDOW', 0.25)
+EVENT_GROUP_RATE_LIMIT = getattr(settings, 'RAIDIKALU_EVENT_GROUP_RATE_LIMIT', 10)
+EVENT_GROUP_RATE_BURST = getattr(settings, 'RAIDIKALU_EVENT_GROUP_RATE_BURST', 20)
+GYM_SEARCH_RESULT_LIMIT = getattr(settings, 'RAIDIKALU_GYM_SEARCH_RESULT_LIMIT', 10)
+GYM_NEARBY_RESULT_LIMIT = getattr(settings, 'RAIDIKALU_GYM_NEARBY_RESULT_LIMIT', 10)
+GYM_NEARBY_DEFAULT_RADIUS = getattr(settings, 'RAIDIKALU_GYM_NEARBY_DEFAULT_RADIUS', 1000)
+GYM_NEARBY_MAX_RADIUS = getattr(settings, 'RAIDIKALU_GYM_NEARBY_MAX_RADIUS', 20000)
+DATA_SOURCE_LOCAL_CACHE_TIMEOUT = getattr(settings, 'RAIDIKALU_DATA_SOURCE_LOCAL_CACHE_TIMEOUT', 60)
+DATA_SOURCE_CACHE_TIMEOUT = getattr(settings, 'RAIDIKALU_DATA_SOURCE_CACHE_TIMEOUT', 60 * 60)
+DATA_SOURCE_NEGATIVE_CACHE_TIMEOUT = getattr(settings, 'RAIDIKALU_DATA_SOURCE_NEGATIVE_CACHE_TIMEOUT', 5 * 60)
+INGESTION_RATE_LIMIT = getattr(settings, 'RAIDIKALU_INGESTION_RATE_LIMIT', 10)
+INGESTION_RATE_BURST = getattr(settings, 'RAIDIKALU_INGESTION_RATE_BURST', 100)
+INGESTION_RATE_LIMIT_SHARED = getattr(settings, 'RAIDIKALU_INGESTION_RATE_LIMIT_SHARED', True)
+LOAD_SHED_LATENCY = getattr(settings, 'RAIDIKALU_LOAD_SHED_LATENCY', 1.0)
+LOAD_SHED_COST_FACTOR = getattr(settings, 'RAIDIKALU_LOAD_SHED_COST_FACTOR', 4)
+LATENCY_TRACKED_URL_NAMES = getattr(settings, 'RAIDIKALU_LATENCY_TRACKED_URL_NAMES', [
+  'raidikalu.raid_list',
+  'raidikalu.raid_create',
+  'raidikalu.raid_list_json',
+  'raidikalu.raid_snippet',
+])
+INGESTION_QUEUE_ENABLED = getattr(settings, 'RAIDIKALU_INGESTION_QUEUE_ENABLED', False)
+INGESTION_QUEUE_BATCH_SIZE = getattr(settings, 'RAIDIKALU_INGESTION_QUEUE_BATCH_SIZE', 100)
+INGESTION_QUEUE_MAX_ATTEMPTS = getattr(settings, 'RAIDIKALU_INGESTION_QUEUE_MAX_ATTEMPTS', 3)
+INGESTION_FINGERPRINT_TIMEOUT = getattr(settings, 'RAIDIKALU_INGESTION_FINGERPRINT_TIMEOUT', 5 * 60)
+IDEMPOTENCY_KEY_TIMEOUT = getattr(settings, 'RAIDIKALU_IDEMPOTENCY_KEY_TIMEOUT', 24 * 60 * 60)
+EXPORT_PAGE_SIZE = getattr(settings, 'RAIDIKALU_EXPORT_PAGE_SIZE', 100)
+EXPORT_SETTLE_TIME = getattr(settings, 'RAIDIKALU_EXPORT_SETTLE_TIME', 5)
+GYM_MATCH_RADIUS = getattr(settings, 'RAIDIKALU_GYM_MATCH_RADIUS', 30)
+SPATIAL_MAX_COVERING_CELLS = getattr(settings, 'RAIDIKALU_SPATIAL_MAX_COVERING_CELLS', 16)
+QUERY_BUDGET_MIDDLEWARE_ENABLED = getattr(settings, 'RAIDIKALU_QUERY_BUDGET_MIDDLEWARE_ENABLED', settings.DEBUG)
+QUERY_REPEAT_THRESHOLD = getattr(settings, 'RAIDIKALU_QUERY_REPEAT_THRESHOLD', 3)
+QUERY_BUDGETS = getattr(settings, 'RAIDIKALU_QUERY_BUDGETS', {
+  'raidikalu.raid_list': 10,
+  'raidikalu.raid_list_json': 2,
+  'raidikalu.raid_snippet': 3,
+  'raidikalu.raid_create': 24,
+  'raidikalu.raid_receiver': 16,
+  'raidikalu.raid_batch_receiver': 20,
+  'raidikalu.gym_receiver': 6,
+  'raidikalu.raid_export': 3,
+})
@@ -0,0 +1,110 @@
+import math
+from django.db.models import Q
+from raidikalu import settings
+from raidikalu.utils import GEOHASH_ALPHABET, encode_geohash
+
+
+EARTH_RADIUS_METERS = 6371000.0
+MAX_GEOHASH_PRECISION = 12
+# Every geohash starting with a prefix sorts between the prefix and the prefix followed by this
+GEOHASH_RANGE_END = chr(ord(GEOHASH_ALPHABET[-1]) + 1)
+
+
+class InvalidLocation(ValueError):
+  pass
+
+
+def get_geohash_cell_size(precision):
+  # Returns the height and width of a geohash cell in degrees
+  bits = precision * 5
+  longitude_bits = (bits + 1) // 2
+  latitude_bits = bits // 2
+  return 180.0 / 2 ** latitude_bits, 360.0 / 2 ** longitude_bits
+
+
+def get_covering_geohashes(south, west, north, east, max_cells=None):
+  # Returns the longest geohash prefixes that together cover the bounding box
+  # with at most max_cells cells
+  max_cells = max_cells or settings.SPATIAL_MAX_COVERING_CELLS
+  covering_geohashes = ['']
+  for precision in range(1, MAX_GEOHASH_PRECISION + 1):
+    cell_height, cell_width = get_geohash_cell_size(precision)
+    first_row = int(math.floor((south + 90.0) / cell_height))
+    last_row = int(math.floor((min(north, 90.0 - cell_height / 2) + 90.0) / cell_height))
+    first_column = int(math.floor((west + 180.0) / cell_width))
+    last_column = int(math.floor((min(east, 180.0 - cell_width / 2) + 180.0) / cell_width))
+    if (last_row - first_row + 1) * (last_column - first_column + 1) > max_cells:
+      break
+    covering_geohashes = [
+      encode_geohash(-90.0 + (row + 0.5) * cell_height, -180.0 + (column + 0.5) * cell_width, precision)
+      for row in range(first_row, last_row + 1)
+      for column in range(first_column, last_column + 1)
+    ]
+  return covering_geohashes
+
+
+def get_bbox_query(south, west, north, east, field_prefix=''):
+  # The geohash ranges narrow the search down with the index, the coordinates make it exact
+  geohash_field = field_prefix + 'geohash'
+  query = Q()
+  for geohash in get_covering_geohashes(south, west, north, east):
+    if geohash:
+      query |= Q(**{geohash_field + '__gte': geohash, geohash_field + '__lt': geohash + GEOHASH_RANGE_END})
+  return query & Q(**{
+    field_prefix + 'latitude__gte': south,
+    field_prefix + 'latitude__lte': north,
+    field_prefix + 'longitude__gte': west,
+    field_prefix + 'longitude__lte': east,
+  })
+
+
+def get_radius_bbox(latitude, longitude, radius):
+  latitude_delta = math.degrees(radius / EARTH_RADIUS_METERS)
+  longitude_delta = latitude_delta / max(math.cos(math.radians(latitude)), 0.01)
+  return (
+    max(latitude - latitude_delta, -90.0),
+    max(longitude - longitude_delta, -180.0),
+    min(latitude + latitude_delta, 90.0),
+    min(longitude + longitude_delta, 180.0),
+  )
+
+
+def get_distance(latitude1, longitude1, latitude2, longitude2):
+  # Haversine distance in meters
+  latitude1, longitude1, latitude2, longitude2 = map(math.radians, map(float, (latitude1, longitude1, latitude2, longitude2)))
+  a = math.sin((latitude2 - latitude1) / 2) ** 2 + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+  return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_coordinates(latitude, longitude):
+  try:
+    latitude, longitude = float(latitude), float(longitude)
+  except (TypeError, ValueError):
+    raise InvalidLocation('Invalid coordinates')
+  if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+    raise InvalidLocation('Coordinates out of bounds')
+  return latitude, longitude
+
+
+def parse_bbox(bbox):
+  # The bounding box is given as "west,south,east,north"
+  try:
+    west, south, east, north = [float(value) for value in bbox.split(',')]
+  except ValueError:
+    raise InvalidLocation('Invalid bounding box')
+  south, west = parse_coordinates(south, west)
+  north, east = parse_coordinates(north, east)
+  if south > north or west > east:
+    raise InvalidLocation('Bounding box corners in wrong order')
+  return south, west, north, east
+
+
+def get_nearby_gyms(gyms, latitude, longitude, radius, limit):
+  nearby_gyms = []
+  for gym in gyms.filter(get_bbox_query(*get_radius_bbox(latitude, longitude, radius))):
+    distance = get_distance(latitude, longitude, gym.latitude, gym.longitude)
+    if distance <= radius:
+      setattr(gym, 'distance', distance)
+      nearby_gyms.append(gym)
+  nearby_gyms.sort(key=lambda gym: gym.distance)
+  return nearby_gyms[:limit]
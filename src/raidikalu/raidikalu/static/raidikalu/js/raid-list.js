@@ -99,20 +99,51 @@ function initAttendanceListeners(containerElement) {
 function initMessageListeners() {
 
   var wsScheme = window.location.protocol == 'https:' ? 'wss' : 'ws';
-  var websocket = new ReconnectingWebSocket(wsScheme + '://' + window.location.host + '/ws/');
+  // Topic filters such as ?tier=5&cell=ud9wr are passed on from the page address
+  var wsBaseUrl = wsScheme + '://' + window.location.host + '/ws/' + (window.location.search ? window.location.search + '&' : '?');
+  var lastSequence = EVENT_SEQUENCE;
+  var raidSequences = {};
+  var websocket = new ReconnectingWebSocket(getWebsocketUrl());
 
   websocket.addEventListener('message', handleMessage);
 
 
+  function getWebsocketUrl() {
+    // Reconnects resume from the latest event seen, so only missed events are replayed
+    return wsBaseUrl + 'since=' + lastSequence;
+  }
+
   function handleMessage(event) {
 
     var payload = JSON.parse(event.data);
     var raidName = 'unknown';
 
+    if (payload.event == 'snapshot') {
+      window.location.reload();
+      return;
+    }
+
+    if (payload.seq) {
+      lastSequence = Math.max(lastSequence, payload.seq);
+      websocket.url = getWebsocketUrl();
+    }
+
+    if (payload.data.raid) {
+      // Replayed events may arrive after newer live events of the same raid
+      if (payload.seq && raidSequences[payload.data.raid] >= payload.seq) {
+        return;
+      }
+      raidSequences[payload.data.raid] = payload.seq;
+    }
+
     if (payload.event == 'attendance') {
       attendanceUpdated(payload.data);
     }
 
+    if (payload.event == 'raid') {
+      raidUpdated(payload.data);
+    }
+
     if (payload.data.raid) {
       try {
         raidName = document.querySelector('.raid[data-id="' + payload.data.raid + '"] .raid-name').textContent;
@@ -125,6 +156,105 @@ function initMessageListeners() {
 
   function attendanceUpdated(attendance) {
 
+    var raidElement = document.querySelector('.raid[data-id="' + attendance.raid + '"]');
+    var choiceElement;
+
+    if ( ! raidElement) {
+      return;
+    }
+
+    if ( ! attendance.attendance || ! updateAttendances(raidElement, attendance.attendance)) {
+      fetchRaidSnippet(attendance);
+      return;
+    }
+
+    if (attendance.submitter == NICKNAME) {
+      choiceElement = attendance.choice === null
+        ? raidElement.querySelector('.raid-attandance-cancel')
+        : raidElement.querySelectorAll('.raid-attendance-choice')[attendance.choice];
+      if (choiceElement) {
+        choiceElement.checked = true;
+      }
+    }
+
+  }
+
+  function raidUpdated(raid) {
+
+    var raidElement = document.querySelector('.raid[data-id="' + raid.raid + '"]');
+    var isStartChanged;
+
+    if ( ! raidElement || ! raid.attendance) {
+      return;
+    }
+
+    isStartChanged = raidElement.getAttribute('data-start') != (raid.start === null ? '' : String(raid.start));
+    if (isStartChanged || ! updateAttendances(raidElement, raid.attendance)) {
+      fetchRaidSnippet({raid: raid.raid, choice: null, submitter: null});
+    }
+
+  }
+
+  function updateAttendances(raidElement, attendance) {
+
+    var choiceCountElements = raidElement.querySelectorAll('.raid-attendance-choice + label span');
+    var countElement = raidElement.querySelector('.raid-attendance-count');
+    var sharingLinksElement = raidElement.querySelector('.sharing-links');
+    var oldAttendeesElements = raidElement.querySelectorAll('.raid-attendees');
+    var i;
+
+    if (choiceCountElements.length != attendance.start_times.length || ! countElement) {
+      return false;
+    }
+
+    for (i = 0; i < oldAttendeesElements.length; i++) {
+      oldAttendeesElements[i].parentNode.removeChild(oldAttendeesElements[i]);
+    }
+
+    attendance.start_times.forEach(function updateStartTime(startTime, choiceIndex) {
+
+      var attendeesElement;
+
+      choiceCountElements[choiceIndex].textContent = startTime.attendees.length;
+
+      if ( ! startTime.attendees.length) {
+        return;
+      }
+
+      attendeesElement = document.createElement('div');
+      attendeesElement.className = 'raid-attendees';
+      attendeesElement.appendChild(createAttendeeElement(startTime.time, true));
+      startTime.attendees.forEach(function addAttendee(attendee) {
+        attendeesElement.appendChild(createAttendeeElement('- ' + attendee, false));
+      });
+      sharingLinksElement.parentNode.insertBefore(attendeesElement, sharingLinksElement);
+
+    });
+
+    countElement.querySelector('strong').textContent = attendance.count;
+    countElement.style.display = attendance.count ? '' : 'none';
+
+    return true;
+
+  }
+
+  function createAttendeeElement(text, isStrong) {
+
+    var attendeeElement = document.createElement('div');
+    var textElement = isStrong ? document.createElement('strong') : attendeeElement;
+
+    attendeeElement.className = 'raid-attendee';
+    textElement.textContent = text;
+    if (isStrong) {
+      attendeeElement.appendChild(textElement);
+    }
+
+    return attendeeElement;
+
+  }
+
+  function fetchRaidSnippet(attendance) {
+
     var request = new XMLHttpRequest();
     request.open('GET', '/api/1/raid-snippet/' + attendance.raid + '/?t=' + (new Date().getTime()), true);
     request.addEventListener('load', handleRaidData);
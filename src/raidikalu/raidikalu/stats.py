@@ -0,0 +1,56 @@
+from django.core.cache import cache
+
+
+STATS_CACHE_KEY_PREFIX = 'raidikalu_stats_'
+STATS_CACHE_TIMEOUT = 30 * 24 * 60 * 60
+
+STAT_NAMES = [
+  'reaper_runs',
+  'reaper_archived_raids',
+  'reaper_deleted_raids',
+  'reaper_deleted_rows',
+  'reaper_last_archived_raids',
+  'reaper_last_deleted_raids',
+  'reaper_last_deleted_rows',
+  'reaper_last_duration',
+  'reaper_last_run_at',
+  'events_received',
+  'events_coalesced',
+  'events_deferred',
+  'events_published',
+  'auth_cache_misses',
+  'auth_rejected_requests',
+  'ingestion_throttled_requests',
+  'ingestion_degraded_requests',
+  'ingestion_too_large_requests',
+  'ingestion_duplicates',
+  'ingestion_queue_received',
+  'ingestion_queue_processed',
+  'ingestion_queue_batches',
+  'ingestion_queue_retried',
+  'ingestion_queue_failed',
+  'ingestion_queue_last_lag',
+  'gym_resolver_id_matches',
+  'gym_resolver_location_matches',
+  'gym_resolver_misses',
+  'gym_resolver_rebuilds',
+]
+
+
+def increment_stat(stat_name, amount=1):
+  cache_key = STATS_CACHE_KEY_PREFIX + stat_name
+  try:
+    cache.incr(cache_key, amount)
+  except ValueError:
+    if not cache.add(cache_key, amount, STATS_CACHE_TIMEOUT):
+      cache.incr(cache_key, amount)
+
+
+def set_stat(stat_name, value):
+  cache.set(STATS_CACHE_KEY_PREFIX + stat_name, value, STATS_CACHE_TIMEOUT)
+
+
+def get_stats():
+  cache_keys = [STATS_CACHE_KEY_PREFIX + stat_name for stat_name in STAT_NAMES]
+  values = cache.get_many(cache_keys)
+  return {stat_name: values.get(STATS_CACHE_KEY_PREFIX + stat_name, None) for stat_name in STAT_NAMES}
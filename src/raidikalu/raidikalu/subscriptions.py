@@ -0,0 +1,53 @@
+from itertools import product
+from urllib.parse import parse_qs
+from raidikalu import settings
+from raidikalu.utils import encode_geohash
+
+
+GROUP_NAME = 'raidikalu'
+ANY = '_'
+ALLOWED_CELL_CHARACTERS = set('0123456789bcdefghjkmnpqrstuvwxyz')
+
+
+def get_group_name(tier=None, raid_type=None, cell=None):
+  if tier is None and raid_type is None and cell is None:
+    return GROUP_NAME
+  return '%s.t%s.r%s.c%s' % (GROUP_NAME, tier or ANY, raid_type or ANY, cell or ANY)
+
+
+def get_raid_cell(raid):
+  return encode_geohash(raid.gym.latitude, raid.gym.longitude, settings.SUBSCRIPTION_CELL_PRECISION)
+
+
+def get_raid_group_names(raid):
+  # An event is published once to every combination of its own topics and wildcards,
+  # so each subscriber receives it through at most one of their groups
+  tiers = [None, str(raid.tier)] if raid.tier else [None]
+  raid_types = [None, str(raid.raid_type_id)] if raid.raid_type_id else [None]
+  cells = [None, get_raid_cell(raid)]
+  return [get_group_name(*topics) for topics in product(tiers, raid_types, cells)]
+
+
+def parse_query_string(query_string):
+  if isinstance(query_string, bytes):
+    query_string = query_string.decode('utf-8', 'ignore')
+  return parse_qs(query_string or '')
+
+
+def get_resume_sequence(query_string):
+  since = parse_query_string(query_string).get('since', [''])[0]
+  return int(since) if since.isdigit() else None
+
+
+def get_subscription_group_names(query_string):
+  query = parse_query_string(query_string)
+  tiers = sorted(set(tier for tier in query.get('tier', []) if tier.isdigit()))
+  raid_types = sorted(set(raid_type for raid_type in query.get('type', []) if raid_type.isdigit()))
+  cells = sorted(set(
+    cell.lower() for cell in query.get('cell', [])
+    if len(cell) == settings.SUBSCRIPTION_CELL_PRECISION and set(cell.lower()) <= ALLOWED_CELL_CHARACTERS
+  ))
+  group_names = [get_group_name(*topics) for topics in product(tiers or [None], raid_types or [None], cells or [None])]
+  if len(group_names) > settings.MAX_SUBSCRIPTION_GROUPS:
+    return [GROUP_NAME]
+  return group_names
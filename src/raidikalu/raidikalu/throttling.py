@@ -0,0 +1,121 @@
+import threading
+import time
+from django.core.cache import cache
+from raidikalu import settings
+
+
+RATE_LIMIT_CACHE_KEY = 'raidikalu_rate_limit_%s'
+RATE_LIMIT_LOCK_CACHE_KEY = 'raidikalu_rate_limit_lock_%s'
+PAGE_LATENCY_CACHE_KEY = 'raidikalu_page_latency'
+
+
+class TokenBucketRateLimiter(object):
+  # Buckets are kept in the shared cache so that all processes count against the same
+  # limit, or in process memory when shared is off. A shared bucket is updated while
+  # holding a lock key in the cache, which expires in case its holder dies.
+  LOCK_TIMEOUT = 5
+  LOCK_WAIT = 1.0
+  LOCK_POLL_INTERVAL = 0.01
+
+  def __init__(self, rate, burst, shared=True):
+    self.rate = rate
+    self.burst = burst
+    self.shared = shared
+    self.lock = threading.Lock()
+    self.buckets = {}
+
+  def get_bucket(self, key):
+    if self.shared:
+      return cache.get(RATE_LIMIT_CACHE_KEY % key)
+    return self.buckets.get(key, None)
+
+  def set_bucket(self, key, bucket):
+    if self.shared:
+      # A bucket left alone long enough is full again, so it does not need to be kept
+      cache.set(RATE_LIMIT_CACHE_KEY % key, bucket, int(self.burst / self.rate) + 60)
+    else:
+      self.buckets[key] = bucket
+
+  def is_too_large(self, cost):
+    # A cost larger than the burst could never be paid, however long the caller waits
+    return bool(self.rate) and cost > self.burst
+
+  def acquire(self, key, cost=1):
+    # Takes the tokens and returns 0, or returns the seconds until enough tokens are available
+    if not self.rate:
+      return 0
+    if self.is_too_large(cost):
+      raise ValueError('Cost %s is larger than the burst %s' % (cost, self.burst))
+    if not self.shared:
+      with self.lock:
+        return self.take_tokens(key, cost)
+    lock_key = RATE_LIMIT_LOCK_CACHE_KEY % key
+    if not self.acquire_cache_lock(lock_key):
+      # The bucket is too busy to tell, so the caller is asked to come back a bit later
+      return self.LOCK_WAIT
+    try:
+      return self.take_tokens(key, cost)
+    finally:
+      cache.delete(lock_key)
+
+  def acquire_cache_lock(self, lock_key):
+    deadline = time.time() + self.LOCK_WAIT
+    while not cache.add(lock_key, True, self.LOCK_TIMEOUT):
+      if time.time() >= deadline:
+        return False
+      time.sleep(self.LOCK_POLL_INTERVAL)
+    return True
+
+  def take_tokens(self, key, cost):
+    now = time.time()
+    tokens, updated_at = self.get_bucket(key) or (self.burst, now)
+    tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+    if tokens < cost:
+      return (cost - tokens) / self.rate
+    self.set_bucket(key, (tokens - cost, now))
+    return 0
+
+
+class LatencyMonitor(object):
+  # Follows a moving average of the user-facing request durations in this process and
+  # publishes it to the cache every few seconds. The published average expires when
+  # no pages are served, so an idle site is never considered degraded.
+  PUBLISH_INTERVAL = 5
+  PUBLISH_TIMEOUT = 30
+  SMOOTHING = 0.1
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.latency = None
+    self.published_at = 0
+
+  def record(self, duration):
+    with self.lock:
+      if self.latency is None:
+        self.latency = duration
+      else:
+        self.latency += (duration - self.latency) * self.SMOOTHING
+      now = time.time()
+      if now - self.published_at < self.PUBLISH_INTERVAL:
+        return
+      self.published_at = now
+      latency = self.latency
+    cache.set(PAGE_LATENCY_CACHE_KEY, latency, self.PUBLISH_TIMEOUT)
+
+  def get_latency(self):
+    return cache.get(PAGE_LATENCY_CACHE_KEY)
+
+  def is_degraded(self):
+    if not settings.LOAD_SHED_LATENCY:
+      return False
+    latency = self.get_latency()
+    return latency is not None and latency > settings.LOAD_SHED_LATENCY
+
+
+ingestion_rate_limiter = TokenBucketRateLimiter(
+  settings.INGESTION_RATE_LIMIT,
+  settings.INGESTION_RATE_BURST,
+  settings.INGESTION_RATE_LIMIT_SHARED,
+)
+
+page_latency_monitor = LatencyMonitor()
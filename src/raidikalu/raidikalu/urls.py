@@ -1,13 +1,18 @@
 
 from django.conf.urls import url
-from raidikalu.views import RaidListView, RaidSnippetView, RaidCreateView, RaidReceiverView, GymReceiverView, RaidJsonExportView
+from raidikalu.views import RaidListView, RaidListJsonView, RaidSnippetView, RaidCreateView, RaidReceiverView, RaidBatchReceiverView, GymReceiverView, RaidJsonExportView, GymSearchView, GymNearbyView, StatsView
 
 
 urlpatterns = [
   url('^$', RaidListView.as_view(), name='raidikalu.raid_list'),
   url('^ilmoita-raidi/$', RaidCreateView.as_view(), name='raidikalu.raid_create'),
   url('^api/1/raid-receiver/(?P<api_key>[^/]+)/$', RaidReceiverView.as_view(), name='raidikalu.raid_receiver'),
+  url('^api/1/raid-receiver/(?P<api_key>[^/]+)/batch/$', RaidBatchReceiverView.as_view(), name='raidikalu.raid_batch_receiver'),
   url('^api/1/gym-receiver/(?P<api_key>[^/]+)/$', GymReceiverView.as_view(), name='raidikalu.gym_receiver'),
   url('^api/1/raid-export/(?P<api_key>[^/]+)/$', RaidJsonExportView.as_view(), name='raidikalu.raid_export'),
+  url('^api/1/raids/$', RaidListJsonView.as_view(), name='raidikalu.raid_list_json'),
   url('^api/1/raid-snippet/(?P<pk>[^/]+)/$', RaidSnippetView.as_view(), name='raidikalu.raid_snippet'),
+  url('^api/1/gyms/search/$', GymSearchView.as_view(), name='raidikalu.gym_search'),
+  url('^api/1/gyms/nearby/$', GymNearbyView.as_view(), name='raidikalu.gym_nearby'),
+  url('^api/1/stats/$', StatsView.as_view(), name='raidikalu.stats'),
 ]
@@ -1,5 +1,7 @@
 
+import time
 from django.core.cache import cache
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -21,3 +23,61 @@ def get_nickname(request):
     request.session['anonymous_nickname'] = _('#anonymous-nickname') % anonymous_counter
     return request.session['anonymous_nickname']
 
+
+
+DATA_VERSION_CACHE_KEY = 'raidikalu_data_version'
+
+
+def get_cache_version(cache_key):
+  version = cache.get(cache_key)
+  if version is None:
+    # Starting from the current time keeps versions unique even if the cache is cleared
+    cache.add(cache_key, int(time.time() * 1000), None)
+    version = cache.get(cache_key)
+  return version
+
+
+def bump_cache_version(cache_key, delta=1):
+  try:
+    return cache.incr(cache_key, delta)
+  except ValueError:
+    get_cache_version(cache_key)
+    return cache.incr(cache_key, delta)
+
+
+def get_data_version():
+  return get_cache_version(DATA_VERSION_CACHE_KEY)
+
+
+def bump_cache_version_on_commit(cache_key):
+  # Bumped only once the data is visible to other requests, as a page cached under the
+  # new version before the commit would keep the old data
+  transaction.on_commit(lambda: bump_cache_version(cache_key))
+
+
+def bump_data_version(**kwargs):
+  bump_cache_version_on_commit(DATA_VERSION_CACHE_KEY)
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(latitude, longitude, precision=12):
+  # Bits alternate between longitude and latitude, starting with longitude
+  coordinates = [float(longitude), float(latitude)]
+  ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+  geohash = []
+  bits = 0
+  for bit_index in range(precision * 5):
+    axis = bit_index % 2
+    middle = (ranges[axis][0] + ranges[axis][1]) / 2
+    bits <<= 1
+    if coordinates[axis] >= middle:
+      bits |= 1
+      ranges[axis][0] = middle
+    else:
+      ranges[axis][1] = middle
+    if bit_index % 5 == 4:
+      geohash.append(GEOHASH_ALPHABET[bits])
+      bits = 0
+  return ''.join(geohash)
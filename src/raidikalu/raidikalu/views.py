@@ -1,53 +1,63 @@
 
+import hashlib
 import json
 import logging
+import math
 import re
 from calendar import timegm
-from datetime import timedelta, datetime
+from datetime import timedelta
+from operator import attrgetter
 from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from django.db.models.signals import post_save, pre_delete
-from django.http import HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.cache import parse_etags
 from django.utils.decorators import method_decorator
-from django.utils.translation import ugettext_lazy as _
+from django.utils.html import escape
+from django.utils.translation import get_language, ugettext_lazy as _
 from django.views import View
 from django.views.generic import TemplateView
 from django.views.decorators.csrf import csrf_exempt
-from raidikalu.messages import attendance_updated
-from raidikalu.models import InfoBox, Gym, RaidType, Raid, DataSource, RaidVote, Attendance
-from raidikalu.utils import get_nickname
+from raidikalu import settings
+from raidikalu.authentication import authenticate_data_source, get_data_source_stats
+from raidikalu.gym_search import search_gyms
+from raidikalu.ingestion import RESULT_INVALID, RESULT_QUEUED, RESULT_UNKNOWN_GYM, enqueue_raids, get_ingestion_queue_stats, ingest_raids, parse_raid_data_list
+from raidikalu.messages import attendance_updated, get_event_sequence, get_raid_data
+from raidikalu.models import InfoBox, Gym, Raid, RaidVote, Attendance, raid_type_registry
+from raidikalu.spatial import InvalidLocation, get_bbox_query, get_nearby_gyms, parse_bbox, parse_coordinates
+from raidikalu.stats import get_stats, increment_stat
+from raidikalu.throttling import ingestion_rate_limiter, page_latency_monitor
+from raidikalu.utils import bump_data_version, get_data_version, get_nickname
 
 
 LOG = logging.getLogger(__name__)
 
-THRESHOLD_OF_LOOKING_A_LOT_LIKE_MILLISECONDS = 1000000000000
-
 
 class BaseRaidView(TemplateView):
-  def update_raid_context(self, raid):
-    nickname = get_nickname(self.request)
+  def update_raid_context(self, raid, nickname=None):
     setattr(raid, 'own_start_time_choice', None)
-    start_times_with_attendances = []
-    raid_attendances = raid.attendances.all()
-    for choice_index, start_time_choice in enumerate(raid.get_start_time_choices()):
-      attendances_at_time = []
-      for attendance in raid_attendances:
-        if attendance.start_time_choice == choice_index:
-          attendances_at_time.append(attendance)
-          if attendance.submitter == nickname:
-            setattr(raid, 'own_start_time_choice', choice_index)
-      start_times_with_attendances.append({
-        'time': start_time_choice,
-        'attendances': attendances_at_time,
-      })
+    start_times_with_attendances = raid.get_start_times_with_attendances()
+    if nickname:
+      for choice_index, start_time in enumerate(start_times_with_attendances):
+        if nickname in start_time['attendees']:
+          setattr(raid, 'own_start_time_choice', choice_index)
     setattr(raid, 'start_times_with_attendances', start_times_with_attendances)
-    setattr(raid, 'attendance_count', len(raid_attendances))
 
 
 class RaidListView(BaseRaidView):
   template_name = 'raidikalu/raid_list.html'
   NICKNAME_CLEANUP_REGEX = re.compile(r'[^A-Za-z0-9]+')
+  PAGE_CACHE_TIMEOUT = 60 * 60
+  # The shared page is rendered with these in place of per-user values
+  SESSION_NICKNAME_PLACEHOLDER = '__raidikalu_session_nickname__'
+  REQUEST_NICKNAME_PLACEHOLDER = '__raidikalu_request_nickname__'
+  CSRF_TOKEN_PLACEHOLDER = '__raidikalu_csrf_token__'
+  EVENT_SEQUENCE_PLACEHOLDER = '__raidikalu_event_sequence__'
 
   def post(self, request, *args, **kwargs):
     action = request.POST.get('action', None)
@@ -59,20 +69,28 @@ class RaidListView(BaseRaidView):
       old_nickname = get_nickname(request)
       anonymous_nickname_prefix = _('#anonymous-startswith')
       if old_nickname.startswith(str(anonymous_nickname_prefix)):
-        Attendance.objects.filter(submitter=old_nickname).update(submitter=nickname)
+        # Only one attendance per submitter is allowed for a raid, so the ones
+        # the new nickname already has are kept
+        old_attendances = Attendance.objects.filter(submitter=old_nickname)
+        raid_ids = list(old_attendances.values_list('raid_id', flat=True))
+        old_attendances.filter(raid__attendances__submitter=nickname).delete()
+        old_attendances.update(submitter=nickname)
+        Raid.rebuild_attendees(raid_ids)
+        bump_data_version()
       request.session['nickname'] = nickname
       return HttpResponse('OK')
 
     if action == 'set-attendance':
       nickname = get_nickname(request)
-      raid = get_object_or_404(Raid, pk=request.POST.get('raid', None))
+      raid = get_object_or_404(Raid.objects.select_related('gym'), pk=request.POST.get('raid', None))
       choice = request.POST.get('choice', '')
       if choice == 'cancel':
         try:
           attendance = Attendance.objects.get(raid=raid, submitter=nickname)
+          attendance.raid = raid
+          attendance.delete()
           attendance.start_time_choice = None
           attendance_updated(attendance, raid)
-          attendance.delete()
         except Attendance.DoesNotExist:
           return HttpResponse('fail')
         return HttpResponse('OK')
@@ -85,23 +103,66 @@ class RaidListView(BaseRaidView):
         return HttpResponse('fail')
       attendance, created = Attendance.objects.get_or_create(raid=raid, submitter=nickname, defaults={'start_time_choice': choice})
       if not created:
+        attendance.raid = raid
         attendance.start_time_choice = choice
         attendance.save()
       attendance_updated(attendance, raid)
       return HttpResponse('OK')
     return self.get(request, *args, **kwargs)
 
+  def get(self, request, *args, **kwargs):
+    page = self.get_shared_page(**kwargs)
+    nickname = get_nickname(request)
+    content = page['content']
+    content = content.replace(self.SESSION_NICKNAME_PLACEHOLDER, escape(request.session.get('nickname', None) or ''))
+    content = content.replace(self.REQUEST_NICKNAME_PLACEHOLDER, escape(nickname))
+    content = content.replace(self.CSRF_TOKEN_PLACEHOLDER, get_token(request))
+    content = content.replace(self.EVENT_SEQUENCE_PLACEHOLDER, str(page['event_sequence']))
+    for raid_pk, choice_index in page['start_time_choices'].get(nickname, []):
+      content = content.replace('<input checked id="rac-%s-cancel"' % raid_pk, '<input id="rac-%s-cancel"' % raid_pk)
+      content = content.replace('<input id="rac-%s-%s"' % (raid_pk, choice_index), '<input checked id="rac-%s-%s"' % (raid_pk, choice_index))
+    return HttpResponse(content)
+
+  def get_shared_page(self, **kwargs):
+    # The page is the same for everyone until the data changes or a raid starts or ends
+    base_url_hash = hashlib.md5(self.request.build_absolute_uri('/').encode('utf-8')).hexdigest()
+    cache_key = 'raid_list_page_%s_%s_%s' % (get_data_version(), get_language(), base_url_hash)
+    page = cache.get(cache_key)
+    if page and (page['valid_until'] is None or timezone.now() < page['valid_until']):
+      return page
+    # Read before the raids, so that a client resuming from it gets any change made
+    # while the page is rendered from the event stream
+    event_sequence = get_event_sequence()
+    context = self.get_context_data(**kwargs)
+    start_time_choices = {}
+    for raid in context['raids']:
+      for choice_index, start_time in enumerate(raid.start_times_with_attendances):
+        for attendee in start_time['attendees']:
+          start_time_choices.setdefault(attendee, []).append((raid.pk, choice_index))
+    upcoming_times = [time for raid in context['raids'] for time in (raid.start_at, raid.end_at) if time and time > context['now']]
+    page = {
+      'content': render_to_string(self.template_name, context, request=self.request),
+      'event_sequence': event_sequence,
+      'start_time_choices': start_time_choices,
+      'valid_until': min(upcoming_times) if upcoming_times else None,
+    }
+    cache.set(cache_key, page, self.PAGE_CACHE_TIMEOUT)
+    return page
+
   def get_queryset(self):
     qs = Raid.objects.exclude(end_at__lte=timezone.now())
-    return qs.select_related('gym').prefetch_related('attendances').order_by('start_at')
+    return qs.select_related('gym').order_by('start_at')
 
   def get_context_data(self, **kwargs):
     context = super(RaidListView, self).get_context_data(**kwargs)
     context['infobox_content'] = InfoBox.get_infobox_content()
-    context['raid_types'] = RaidType.objects.filter(is_active=True)
+    context['raid_types'] = raid_type_registry.get_active()
     context['raids'] = self.get_queryset()
-    context['request_nickname'] = get_nickname(self.request)
+    context['session_nickname'] = self.SESSION_NICKNAME_PLACEHOLDER
+    context['request_nickname'] = self.REQUEST_NICKNAME_PLACEHOLDER
+    context['csrf_token'] = self.CSRF_TOKEN_PLACEHOLDER
     context['now'] = timezone.now()
+    context['event_sequence'] = self.EVENT_SEQUENCE_PLACEHOLDER
     for raid in context['raids']:
       self.update_raid_context(raid)
     return context
@@ -145,50 +206,89 @@ post_save.connect(invalidate_raid_snippet_from_attendance, sender='raidikalu.Att
 pre_delete.connect(invalidate_raid_snippet_from_attendance, sender='raidikalu.Attendance')
 
 
+class RaidListJsonView(View):
+  CACHE_TIMEOUT = 2 * 60 * 60
+
+  def get(self, request, *args, **kwargs):
+    bbox = None
+    if request.GET.get('bbox', None):
+      try:
+        bbox = parse_bbox(request.GET['bbox'])
+      except InvalidLocation:
+        return HttpResponseBadRequest('fail')
+
+    # The data version is bumped by every raid, vote and attendance write, so
+    # polling clients can be answered from it alone without touching the database
+    data_version = get_data_version()
+    etag = '"%s"' % data_version
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag in if_none_match or '*' in if_none_match:
+      response = HttpResponseNotModified()
+      response['ETag'] = etag
+      return response
+
+    cache_key = 'raid_list_json_%s' % data_version
+    if bbox:
+      cache_key += '_%s' % '_'.join('%.6f' % coordinate for coordinate in bbox)
+    content = cache.get(cache_key)
+    if content is None:
+      raids = Raid.objects.exclude(end_at__lte=timezone.now())
+      if bbox:
+        raids = raids.filter(get_bbox_query(*bbox, field_prefix='gym__'))
+      raids = raids.select_related('gym').order_by('start_at')
+      content = json.dumps([get_raid_data(raid) for raid in raids], separators=(',', ':'))
+      cache.set(cache_key, content, self.CACHE_TIMEOUT)
+
+    response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
 class RaidCreateView(TemplateView):
   template_name = 'raidikalu/raid_create.html'
   ABSOLUTE_TIME_REGEX = re.compile(r'^(?P<hours>\d?\d).?(?P<minutes>\d\d)$')
 
   def post(self, request, *args, **kwargs):
-    raid_types = RaidType.objects.filter(is_active=True)
+    raid_types = raid_type_registry.get_active()
     ALLOWED_TIERS = ['1', '2', '3', '4', '5']
     ALLOWED_MONSTERS = [raid_type.monster_name for raid_type in raid_types]
 
     gym_id = request.POST.get('gym', None)
     gym = get_object_or_404(Gym, pk=gym_id)
-    raid, created = Raid.objects.get_or_create(gym=gym)
-
-    if created:
-      raid.submitter = request.session.get('nickname', None) or ''
+    # One commit for the report, so the raid's change sequence is stamped once
+    with transaction.atomic():
+      raid, created = Raid.get_or_create_active(gym, defaults={
+        'submitter': request.session.get('nickname', None) or '',
+      })
 
-    votes = []
+      votes = []
 
-    raid_start_at = self.get_raid_start_at()
-    if raid_start_at:
-      utc_timestamp = timegm(raid_start_at.utctimetuple())
-      votes.append({
-        'vote_field': RaidVote.FIELD_START_AT,
-        'vote_value': utc_timestamp,
-      })
+      raid_start_at = self.get_raid_start_at()
+      if raid_start_at:
+        utc_timestamp = timegm(raid_start_at.utctimetuple())
+        votes.append({
+          'vote_field': RaidVote.FIELD_START_AT,
+          'vote_value': utc_timestamp,
+        })
 
-    raid_boss = request.POST.get('raid-boss', None)
-    if raid_boss and raid_boss.startswith('tier-'):
-      tier = raid_boss.split('tier-')[1]
-      if tier in ALLOWED_TIERS:
+      raid_boss = request.POST.get('raid-boss', None)
+      if raid_boss and raid_boss.startswith('tier-'):
+        tier = raid_boss.split('tier-')[1]
+        if tier in ALLOWED_TIERS:
+          votes.append({
+            'vote_field': RaidVote.FIELD_TIER,
+            'vote_value': int(tier),
+          })
+      elif raid_boss in ALLOWED_MONSTERS:
         votes.append({
-          'vote_field': RaidVote.FIELD_TIER,
-          'vote_value': int(tier),
+          'vote_field': RaidVote.FIELD_MONSTER,
+          'vote_value': raid_boss,
         })
-    elif raid_boss in ALLOWED_MONSTERS:
-      votes.append({
-        'vote_field': RaidVote.FIELD_MONSTER,
-        'vote_value': raid_boss,
-      })
 
-    for vote in votes:
-      RaidVote.objects.create(raid=raid, vote_field=vote['vote_field'], vote_value=vote['vote_value'])
+      for vote in votes:
+        RaidVote.objects.create(raid=raid, vote_field=vote['vote_field'], vote_value=vote['vote_value'])
 
-    raid.count_votes_and_update()
+      raid.count_votes_and_update()
     return redirect('raidikalu.raid_list')
 
   def get_raid_start_at(self):
@@ -235,115 +335,274 @@ class RaidCreateView(TemplateView):
 
   def get_context_data(self, **kwargs):
     context = super(RaidCreateView, self).get_context_data(**kwargs)
-    context['raid_types'] = RaidType.objects.filter(is_active=True)
-    context['gyms'] = Gym.objects.filter(is_active=True).order_by('name').prefetch_related('nicknames')
+    context['raid_types'] = raid_type_registry.get_active()
     return context
 
 
-class RaidJsonExportView(View):
-  def get(self, request, *args, **kwargs):
-    data_source_api_key = self.kwargs.get('api_key')
-    data_source = DataSource.objects.get(api_key=data_source_api_key)
-    already_received_raid_ids = RaidVote.objects.filter(data_source=data_source, vote_field=RaidVote.FIELD_MONSTER).values_list('raid_id', flat=True).distinct()
-    raids = Raid.objects.exclude(id__in=already_received_raid_ids).select_related('gym')
-    raids_json = []
-    for raid in raids:
-      raids_json.append({
-        'id': raid.pk,
-        'tier': raid.tier,
-        'gym_id': raid.gym.pogo_id,
-        'latitude': raid.gym.latitude,
-        'longitude': raid.gym.longitude,
-        'monster': raid.monster_name,
-        'fast_move': raid.fast_move,
-        'charge_move': raid.charge_move,
-        'start_time': timegm(raid.start_at.utctimetuple()) if raid.start_at else None,
-        'end_time': timegm(raid.end_at.utctimetuple()) if raid.end_at else None,
-        'created_at': timegm(raid.created_at.utctimetuple()) if raid.created_at else None,
-      })
-    return JsonResponse(raids_json, safe=False, json_dumps_params={'separators': (',', ':')})
+class DataSourceMixin(object):
+  def dispatch(self, request, *args, **kwargs):
+    self.data_source = authenticate_data_source(kwargs.get('api_key', None))
+    if not self.data_source:
+      return HttpResponseForbidden('fail')
+    return super(DataSourceMixin, self).dispatch(request, *args, **kwargs)
+
+
+class IdempotencyMixin(object):
+  # A retried request with the same Idempotency-Key gets the stored response of the first one
+  IDEMPOTENCY_CACHE_KEY = 'raidikalu_idempotency_%s_%s'
+
+  def dispatch(self, request, *args, **kwargs):
+    idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY', None)
+    if not idempotency_key:
+      return super(IdempotencyMixin, self).dispatch(request, *args, **kwargs)
+    key_hash = hashlib.sha256(idempotency_key.encode('utf-8')).hexdigest()
+    cache_key = self.IDEMPOTENCY_CACHE_KEY % (self.data_source.pk, key_hash)
+    stored_response = cache.get(cache_key)
+    if stored_response:
+      status, content_type, content = stored_response
+      return HttpResponse(content, status=status, content_type=content_type)
+    response = super(IdempotencyMixin, self).dispatch(request, *args, **kwargs)
+    if 200 <= response.status_code < 300:
+      stored_response = (response.status_code, response['Content-Type'], response.content)
+      cache.set(cache_key, stored_response, settings.IDEMPOTENCY_KEY_TIMEOUT)
+    return response
 
 
-@method_decorator(csrf_exempt, name='dispatch')
-class RaidReceiverView(View):
-  def post(self, request, *args, **kwargs):
-    data_source_api_key = self.kwargs.get('api_key')
-    data_source = DataSource.objects.get(api_key=data_source_api_key)
-    raid_data = json.loads(request.body)
+class IngestionThrottleMixin(object):
+  # Limits the requests of each data source with a token bucket. While pages are slow,
+  # ingestion costs more tokens, so that a busy feed cannot starve the raid list.
+  def dispatch(self, request, *args, **kwargs):
+    cost = self.get_request_cost(request)
+    if ingestion_rate_limiter.is_too_large(cost):
+      # Retrying would never help, the batch has to be split
+      increment_stat('ingestion_too_large_requests')
+      return HttpResponse('fail', status=413)
+    if page_latency_monitor.is_degraded():
+      increment_stat('ingestion_degraded_requests')
+      # The extra cost is capped at the burst, so that a batch that fits is not refused for good
+      cost = min(cost * settings.LOAD_SHED_COST_FACTOR, ingestion_rate_limiter.burst)
+    retry_after = ingestion_rate_limiter.acquire(self.data_source.pk, cost)
+    if retry_after:
+      increment_stat('ingestion_throttled_requests')
+      response = HttpResponse('fail', status=429)
+      response['Retry-After'] = int(math.ceil(retry_after))
+      return response
+    return super(IngestionThrottleMixin, self).dispatch(request, *args, **kwargs)
+
+  def get_request_cost(self, request):
+    return 1
+
+
+def get_timestamp(value):
+  return timegm(value.utctimetuple()) if value else None
+
+
+class RaidJsonExportView(DataSourceMixin, View):
+  # The exported fields as (key, model field, conversion), shared by the JSON and NDJSON formats
+  EXPORT_FIELDS = (
+    ('id', 'pk', None),
+    ('tier', 'tier', None),
+    ('gym_id', 'gym__pogo_id', None),
+    ('latitude', 'gym__latitude', None),
+    ('longitude', 'gym__longitude', None),
+    ('monster', 'monster_name', None),
+    ('fast_move', 'fast_move', None),
+    ('charge_move', 'charge_move', None),
+    ('start_time', 'start_at', get_timestamp),
+    ('end_time', 'end_at', get_timestamp),
+    ('created_at', 'created_at', get_timestamp),
+  )
+  EXPORT_KEYS = tuple(key for key, field_name, convert in EXPORT_FIELDS)
+  EXPORT_VALUE_FIELDS = tuple(field_name for key, field_name, convert in EXPORT_FIELDS)
+  EXPORT_GETTERS = tuple(attrgetter(field_name.replace('__', '.')) for key, field_name, convert in EXPORT_FIELDS)
+  EXPORT_CONVERSIONS = tuple((index, convert) for index, (key, field_name, convert) in enumerate(EXPORT_FIELDS) if convert)
 
-    votes = []
+  def get(self, request, *args, **kwargs):
+    if request.GET.get('since', None) is not None:
+      return self.get_changes(request)
+    if request.GET.get('format', None) == 'ndjson':
+      return self.get_stream()
+    raids = Raid.objects.exclude(end_at__lte=timezone.now()).exclude(pk__in=self.get_received_raid_ids())
+    raids_json = [self.get_raid_json(raid) for raid in raids.select_related('gym')]
+    return JsonResponse(raids_json, safe=False, json_dumps_params={'separators': (',', ':')})
 
-    if raid_data.get('tier', None):
-      tier = raid_data.get('tier')
-      votes.append({
-        'vote_field': RaidVote.FIELD_TIER,
-        'vote_value': tier,
-      })
+  def get_stream(self):
+    # Streams one raid per line straight from the database cursor, so that large exports
+    # neither pile up in memory nor keep the partner waiting for the first byte
+    raids = (
+      Raid.objects
+      .exclude(end_at__lte=timezone.now())
+      .exclude(pk__in=self.get_received_raid_ids())
+      .order_by('pk')
+      .values_list(*self.EXPORT_VALUE_FIELDS)
+    )
+    response = StreamingHttpResponse(self.get_raid_lines(raids.iterator()), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    return response
 
-    if raid_data.get('monster', None):
-      votes.append({
-        'vote_field': RaidVote.FIELD_MONSTER,
-        'vote_value': raid_data.get('monster'),
-      })
+  def get_raid_lines(self, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    keys = self.EXPORT_KEYS
+    conversions = self.EXPORT_CONVERSIONS
+    for row in rows:
+      if conversions:
+        row = list(row)
+        for index, convert in conversions:
+          row[index] = convert(row[index])
+      yield encoder.encode(dict(zip(keys, row))) + '\n'
+
+  def get_changes(self, request):
+    # Returns the raids changed after the cursor, oldest change first, with the cursor
+    # to continue from. Sequence numbers are taken once the change is committed. The page
+    # ends before the first raid stamped in the last few seconds, as a raid with a lower
+    # number may still be being stamped and the cursor must not pass it.
+    try:
+      cursor = int(request.GET['since'])
+      limit = max(1, min(int(request.GET.get('limit', settings.EXPORT_PAGE_SIZE)), settings.EXPORT_PAGE_SIZE))
+    except ValueError:
+      return HttpResponseBadRequest('fail')
+    settled_at = timezone.now() - timedelta(seconds=settings.EXPORT_SETTLE_TIME)
+    raids = Raid.objects.filter(change_seq__gt=cursor).exclude(end_at__lte=timezone.now())
+    raids = raids.exclude(pk__in=self.get_received_raid_ids())
+    raids = list(raids.select_related('gym').order_by('change_seq')[:limit + 1])
+    has_more = len(raids) > limit
+    raids = raids[:limit]
+    for index, raid in enumerate(raids):
+      if raid.updated_at > settled_at:
+        raids = raids[:index]
+        has_more = True
+        break
+    next_cursor = raids[-1].change_seq if raids else cursor
+    return JsonResponse({
+      'raids': [self.get_raid_json(raid) for raid in raids],
+      'cursor': next_cursor,
+      'has_more': has_more,
+    }, json_dumps_params={'separators': (',', ':')})
+
+  def get_received_raid_ids(self):
+    # The raids that the data source has reported itself are not sent back to it
+    return RaidVote.objects.filter(data_source=self.data_source, vote_field=RaidVote.FIELD_MONSTER).values('raid_id')
+
+  def get_raid_json(self, raid):
+    raid_json = {}
+    for (key, field_name, convert), getter in zip(self.EXPORT_FIELDS, self.EXPORT_GETTERS):
+      value = getter(raid)
+      raid_json[key] = convert(value) if convert else value
+    return raid_json
 
-    if raid_data.get('fast_move', None):
-      fast_move = raid_data.get('fast_move')
-      fast_move = re.sub(r'([A-Z])', r' \1', fast_move)
-      votes.append({
-        'vote_field': RaidVote.FIELD_FAST_MOVE,
-        'vote_value': fast_move,
-      })
 
-    if raid_data.get('charge_move', None):
-      charge_move = raid_data.get('charge_move')
-      charge_move = re.sub(r'([A-Z])', r' \1', charge_move)
-      votes.append({
-        'vote_field': RaidVote.FIELD_CHARGE_MOVE,
-        'vote_value': charge_move,
-      })
+@method_decorator(csrf_exempt, name='dispatch')
+class RaidReceiverView(DataSourceMixin, IdempotencyMixin, IngestionThrottleMixin, View):
+  def post(self, request, *args, **kwargs):
+    data_source = self.data_source
+    try:
+      raid_data = json.loads(request.body)
+    except ValueError:
+      return HttpResponseBadRequest('fail')
+    if settings.INGESTION_QUEUE_ENABLED:
+      result = enqueue_raids(data_source, [raid_data])[0]
+    else:
+      result = ingest_raids(data_source, [raid_data])[0]
+    if result['status'] == RESULT_INVALID:
+      return HttpResponseBadRequest('fail')
+    if result['status'] == RESULT_QUEUED:
+      return HttpResponse('OK', status=202)
+    if result['status'] == RESULT_UNKNOWN_GYM:
+      return HttpResponseNotFound('fail')
+    return HttpResponse('OK')
 
-    if raid_data.get('start_time', None):
-      start_timestamp = int(raid_data.get('start_time'))
-      is_milliseconds = start_timestamp > THRESHOLD_OF_LOOKING_A_LOT_LIKE_MILLISECONDS
-      if is_milliseconds:
-        start_timestamp = start_timestamp / 1000.0
-      votes.append({
-        'vote_field': RaidVote.FIELD_START_AT,
-        'vote_value': str(int(start_timestamp)),
-      })
 
-    start_at = datetime.fromtimestamp(start_timestamp)
-    start_at = timezone.make_aware(start_at, timezone.get_current_timezone())
-    end_at = start_at + Raid.RAID_BATTLE_DURATION
-    if end_at <= timezone.now():
-      return HttpResponse('OK')
+@method_decorator(csrf_exempt, name='dispatch')
+class RaidBatchReceiverView(DataSourceMixin, IdempotencyMixin, IngestionThrottleMixin, View):
+  def get_raid_data_list(self, request):
+    if not hasattr(self, 'raid_data_list'):
+      self.raid_data_list = parse_raid_data_list(request.body)
+    return self.raid_data_list
+
+  def get_request_cost(self, request):
+    # Each raid in the batch costs as much as a single raid push
+    try:
+      return max(len(self.get_raid_data_list(request)), 1)
+    except ValueError:
+      return 1
 
-    gym = Gym.objects.get(pogo_id=raid_data.get('gym_id'))
-    raid, created = Raid.objects.get_or_create(gym=gym)
+  def post(self, request, *args, **kwargs):
+    data_source = self.data_source
+    try:
+      raid_data_list = self.get_raid_data_list(request)
+    except ValueError:
+      return HttpResponseBadRequest('fail')
+    if settings.INGESTION_QUEUE_ENABLED:
+      results = enqueue_raids(data_source, raid_data_list)
+      return JsonResponse({'results': results}, status=202, json_dumps_params={'separators': (',', ':')})
+    results = ingest_raids(data_source, raid_data_list)
+    return JsonResponse({'results': results}, json_dumps_params={'separators': (',', ':')})
 
-    if created:
-      raid.data_source = data_source
 
-    for vote in votes:
-      RaidVote.objects.get_or_create(raid=raid, data_source=data_source, vote_field=vote['vote_field'], defaults=vote)
+@method_decorator(csrf_exempt, name='dispatch')
+class GymReceiverView(DataSourceMixin, IdempotencyMixin, IngestionThrottleMixin, View):
+  def post(self, request, *args, **kwargs):
+    data_source = self.data_source
+    try:
+      gym_data = json.loads(request.body)
+      pogo_id = gym_data['guid']
+      defaults = {
+        'name': gym_data['name'],
+        'latitude': float(gym_data['latitude']),
+        'longitude': float(gym_data['longitude']),
+        'image_url': gym_data['image_url'].replace('http://', 'https://'),
+        'is_active': False,
+      }
+    except (AttributeError, KeyError, TypeError, ValueError):
+      return HttpResponseBadRequest('fail')
+
+    gym, created = Gym.objects.get_or_create(pogo_id=pogo_id, defaults=defaults)
 
-    raid.count_votes_and_update()
     return HttpResponse('OK')
 
 
-@method_decorator(csrf_exempt, name='dispatch')
-class GymReceiverView(View):
-  def post(self, request, *args, **kwargs):
-    data_source_api_key = self.kwargs.get('api_key')
-    data_source = DataSource.objects.get(api_key=data_source_api_key)
-    gym_data = json.loads(request.body)
-
-    gym, created = Gym.objects.get_or_create(pogo_id=gym_data['guid'], defaults={
-      'name': gym_data['name'],
-      'latitude': gym_data['latitude'],
-      'longitude': gym_data['longitude'],
-      'image_url': gym_data['image_url'].replace('http://', 'https://'),
-      'is_active': False,
-    })
+class GymSearchView(View):
+  MAX_LIMIT = 50
 
-    return HttpResponse('OK')
+  def get(self, request, *args, **kwargs):
+    query = request.GET.get('q', '')
+    try:
+      limit = max(0, min(int(request.GET.get('limit', 0)), self.MAX_LIMIT))
+    except ValueError:
+      return HttpResponseBadRequest('fail')
+    return JsonResponse({'results': search_gyms(query, limit)})
+
+
+class GymNearbyView(View):
+  def get(self, request, *args, **kwargs):
+    try:
+      latitude, longitude = parse_coordinates(request.GET.get('lat', None), request.GET.get('lng', None))
+      radius = float(request.GET.get('radius', settings.GYM_NEARBY_DEFAULT_RADIUS))
+      limit = min(int(request.GET.get('limit', settings.GYM_NEARBY_RESULT_LIMIT)), settings.GYM_NEARBY_RESULT_LIMIT * 5)
+    except (InvalidLocation, ValueError):
+      return HttpResponseBadRequest('fail')
+    # float() accepts "nan" and "inf" too
+    if not math.isfinite(radius) or radius < 0:
+      return HttpResponseBadRequest('fail')
+    radius = min(radius, settings.GYM_NEARBY_MAX_RADIUS)
+    gyms = get_nearby_gyms(Gym.objects.filter(is_active=True), latitude, longitude, radius, max(limit, 0))
+    return JsonResponse({'results': [{
+      'id': gym.pk,
+      'gym_id': gym.pogo_id,
+      'name': gym.name,
+      'image_url': gym.image_url,
+      'latitude': gym.latitude,
+      'longitude': gym.longitude,
+      'distance': round(gym.distance),
+    } for gym in gyms]})
+
+
+class StatsView(View):
+  def get(self, request, *args, **kwargs):
+    if not request.user.is_staff:
+      return HttpResponseForbidden('fail')
+    stats = get_stats()
+    stats['data_sources'] = get_data_source_stats()
+    stats['page_latency'] = page_latency_monitor.get_latency()
+    stats['ingestion_queue'] = get_ingestion_queue_stats()
+    return JsonResponse(stats)